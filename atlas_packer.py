@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pygame
+from headless import init_headless_display
+from spritesheet_visualizer import SAVE_WORKERS, SpriteEntity, copy_pixels, frame_content_hash, write_save_job
+from sprite_index import collect_entity_files
+
+ATLAS_INDEX_VERSION = 1
+ATLAS_INDEX_MAGIC = b"SSAT"
+MAX_PAGE_SIZE = 65535  # Frame positions are stored as uint16 in the binary index
+NO_FIT = np.iinfo(np.int64).max
+
+# Binary index layout, little endian: header, frames, entities, states, entries, then the UTF-8 names
+HEADER_FORMAT = "<4sHHIIIIIII"  # magic, version, page count, page width, page height, frames, entities, states, entries, names size
+FRAME_DTYPE = np.dtype([("page", "<u2"), ("rotated", "u1"), ("reserved", "u1"), ("x", "<u2"), ("y", "<u2"),
+                        ("width", "<u2"), ("height", "<u2"), ("uv", "<f4", 4)])
+ENTITY_DTYPE = np.dtype([("name_offset", "<u4"), ("name_length", "<u4"), ("sprite_width", "<u2"), ("sprite_height", "<u2"),
+                         ("first_state", "<u4"), ("state_count", "<u4")])
+STATE_DTYPE = np.dtype([("name_offset", "<u4"), ("name_length", "<u4"), ("first_entry", "<u4"), ("entry_count", "<u4")])
+ENTRY_DTYPE = np.dtype([("frame", "<u4"), ("offset_x", "<i2"), ("offset_y", "<i2")])
+
+class MaxRectsPage:
+    # Free space is kept as the maximal free rectangles, which may overlap each other. A frame goes into the
+    # free rectangle it fits most tightly along its shorter leftover side (best short side fit).
+    def __init__(self, width, height, allow_rotation=False):
+        self.width = width
+        self.height = height
+        self.allow_rotation = allow_rotation
+        self.free = np.array([[0, 0, width, height]], dtype=np.int64)
+        self.min_size = 1
+        self.largest = (width, height)
+
+    def insert(self, width, height):
+        # Returns (x, y, rotated) or None when no free rectangle can hold the frame
+        best = None
+        orientations = [(False, width, height)]
+        if self.allow_rotation and width != height:
+            orientations.append((True, height, width))
+        largest_width, largest_height = self.largest
+        for rotated, frame_width, frame_height in orientations:
+            # Full pages turn most frames away here without touching the free list
+            if frame_width > largest_width or frame_height > largest_height:
+                continue
+            leftover_x = self.free[:, 2] - frame_width
+            leftover_y = self.free[:, 3] - frame_height
+            fits = (leftover_x >= 0) & (leftover_y >= 0)
+            if not fits.any():
+                continue
+            scores = np.where(fits, np.minimum(leftover_x, leftover_y) << 32 | np.maximum(leftover_x, leftover_y), NO_FIT)
+            index = int(scores.argmin())
+            if best is None or scores[index] < best[0]:
+                best = (scores[index], index, rotated, frame_width, frame_height)
+        if best is None:
+            return None
+        _, index, rotated, frame_width, frame_height = best
+        x, y = self.free[index, :2].tolist()
+        self.place(x, y, frame_width, frame_height)
+        return x, y, rotated
+
+    def place(self, x, y, width, height):
+        free_start = self.free[:, :2]
+        free_end = free_start + self.free[:, 2:]
+        overlaps = ((free_start < (x + width, y + height)) & (free_end > (x, y))).all(axis=1)
+        hit = self.free[overlaps]
+        hit_end = free_end[overlaps]
+        kept = self.free[~overlaps]
+        # Every overlapped free rectangle leaves up to four maximal pieces around the frame: left, right, above and below it
+        pieces = np.repeat(hit[None], 4, axis=0)
+        pieces[0, :, 2] = x - hit[:, 0]
+        pieces[1, :, 0] = x + width
+        pieces[1, :, 2] = hit_end[:, 0] - x - width
+        pieces[2, :, 3] = y - hit[:, 1]
+        pieces[3, :, 1] = y + height
+        pieces[3, :, 3] = hit_end[:, 1] - y - height
+        pieces = pieces.reshape(-1, 4)
+        pieces = pieces[(pieces[:, 2:] >= self.min_size).all(axis=1)]
+        # Untouched rectangles were already maximal, so only the new pieces can be contained in something else,
+        # and only in a rectangle reaching into the area the overlapped ones covered
+        if not len(pieces):
+            self.set_free(kept)
+            return
+        pieces_end = pieces[:, :2] + pieces[:, 2:]
+        kept_end = kept[:, :2] + kept[:, 2:]
+        near = ((kept[:, :2] < pieces_end.max(axis=0)) & (kept_end > pieces[:, :2].min(axis=0))).all(axis=1)
+        others = np.concatenate([kept[near], pieces])
+        others_end = np.concatenate([kept_end[near], pieces_end])
+        contained = ((others[None, :, :2] <= pieces[:, None, :2]) & (pieces_end[:, None] <= others_end[None])).all(axis=2)
+        # Of identical pieces only the first survives, and no piece is dropped for containing itself
+        piece_index = np.arange(len(pieces))
+        contained[:, len(others) - len(pieces):] &= (piece_index[None, :] < piece_index[:, None]) | (pieces[:, None] != pieces[None, :]).any(axis=2)
+        self.set_free(np.concatenate([kept, pieces[~contained.any(axis=1)]]))
+
+    def discard_smaller_than(self, min_size):
+        # Free rectangles narrower than every frame still to come can never be used
+        self.min_size = min_size
+        self.set_free(self.free[(self.free[:, 2] >= min_size) & (self.free[:, 3] >= min_size)])
+
+    def set_free(self, free):
+        self.free = free
+        self.largest = tuple(free[:, 2:].max(axis=0).tolist()) if len(free) else (0, 0)
+
+def pack_rects(sizes, page_width, page_height, padding=0, allow_rotation=False):
+    # Returns an (n, 4) array of (page, x, y, rotated) for the (width, height) sizes and the page count.
+    # Every frame keeps padding pixels to its neighbours and the page edges.
+    placements = np.zeros((len(sizes), 4), dtype=np.int64)
+    pages = []
+    # Long frames first leaves the small ones to fill the gaps
+    order = sorted(range(len(sizes)), key=lambda index: (-max(sizes[index]), -min(sizes[index])))
+    # The smallest side among the frames from each position in the order on
+    min_sides = np.minimum.accumulate([min(sizes[index]) + padding for index in reversed(order)])[::-1].tolist()
+    for position, index in enumerate(order):
+        width, height = sizes[index]
+        if position == 0 or min_sides[position] != min_sides[position - 1]:
+            for page in pages:
+                page.discard_smaller_than(min_sides[position])
+        fits_upright = width + 2 * padding <= page_width and height + 2 * padding <= page_height
+        fits_rotated = allow_rotation and height + 2 * padding <= page_width and width + 2 * padding <= page_height
+        if not (fits_upright or fits_rotated):
+            raise ValueError(f"A {width}x{height} frame does not fit a {page_width}x{page_height} page with {padding}px padding")
+        for page_index, page in enumerate(pages):
+            placement = page.insert(width + padding, height + padding)
+            if placement is not None:
+                break
+        else:
+            page_index = len(pages)
+            page = MaxRectsPage(page_width - padding, page_height - padding, allow_rotation)
+            page.discard_smaller_than(min_sides[position])
+            pages.append(page)
+            placement = page.insert(width + padding, height + padding)
+        x, y, rotated = placement
+        placements[index] = (page_index, x + padding, y + padding, rotated)
+    return placements, len(pages)
+
+class TextureAtlas:
+    # Frames of many entities packed into fixed size pages. frames is a FRAME_DTYPE array with the rect every unique
+    # frame occupies on its page, entities list their states as [frame, offset_x, offset_y] entries in play order.
+    def __init__(self, page_width, page_height, pages, frames, entities):
+        self.page_width = page_width
+        self.page_height = page_height
+        self.pages = pages
+        self.frames = frames
+        self.entities = entities
+
+    @classmethod
+    def pack(cls, sprite_entities, page_width=2048, page_height=2048, padding=1, allow_rotation=False):
+        # Identical frames are packed once even when they come from different entities
+        if not 0 < page_width <= MAX_PAGE_SIZE or not 0 < page_height <= MAX_PAGE_SIZE:
+            raise ValueError(f"Page sizes have to be between 1 and {MAX_PAGE_SIZE}")
+        frame_indices = {}
+        images = []
+        entities = []
+        for sprite_entity in sprite_entities:
+            states = []
+            for state in sprite_entity.states:
+                entries = []
+                for sprite in state.sprites:
+                    image = sprite.get_image()
+                    frame_index = frame_indices.setdefault(sprite.content_hash or frame_content_hash(image), len(frame_indices))
+                    if frame_index == len(images):
+                        images.append(image)
+                    entries.append([frame_index, *(sprite.trim_offset or (0, 0))])
+                states.append({"name": state.name, "frames": entries})
+            entities.append({
+                "name": sprite_entity.name,
+                "sprite_width": sprite_entity.sprite_width,
+                "sprite_height": sprite_entity.sprite_height,
+                "states": states
+            })
+
+        sizes = [image.get_size() for image in images]
+        placements, page_count = pack_rects(sizes, page_width, page_height, padding, allow_rotation)
+        frames = np.zeros(len(images), dtype=FRAME_DTYPE)
+        frames["page"], frames["x"], frames["y"], frames["rotated"] = placements.T
+        size = np.array(sizes, dtype=np.int64).reshape(-1, 2)
+        # Rotated frames are stored turned 90 degrees clockwise, the rect is the area they cover on the page
+        frames["width"] = np.where(placements[:, 3] == 1, size[:, 1], size[:, 0])
+        frames["height"] = np.where(placements[:, 3] == 1, size[:, 0], size[:, 1])
+        frames["uv"] = np.stack([
+            frames["x"] / page_width,
+            frames["y"] / page_height,
+            (frames["x"] + frames["width"].astype(np.int64)) / page_width,
+            (frames["y"] + frames["height"].astype(np.int64)) / page_height
+        ], axis=1)
+
+        pages = [pygame.Surface((page_width, page_height), pygame.SRCALPHA, 32) for _ in range(page_count)]
+        blits = [[] for _ in range(page_count)]
+        for image, (page_index, x, y, rotated) in zip(images, placements.tolist()):
+            if rotated:
+                image = pygame.transform.rotate(image, -90)
+            blits[page_index].append((image, (x, y), None))
+        for page, page_blits in zip(pages, blits):
+            copy_pixels(page, page_blits)
+        return cls(page_width, page_height, pages, frames, entities)
+
+    def page_file_name(self, page_index):
+        return f"page_{page_index}.png"
+
+    def index(self):
+        return {
+            "version": ATLAS_INDEX_VERSION,
+            "page_width": self.page_width,
+            "page_height": self.page_height,
+            "pages": [self.page_file_name(page_index) for page_index in range(len(self.pages))],
+            "frames": [
+                {"page": int(frame["page"]), "x": int(frame["x"]), "y": int(frame["y"]), "width": int(frame["width"]),
+                 "height": int(frame["height"]), "rotated": bool(frame["rotated"]), "uv": frame["uv"].tolist()}
+                for frame in self.frames
+            ],
+            "entities": self.entities
+        }
+
+    def index_bytes(self):
+        names = bytearray()
+
+        def add_name(name):
+            encoded = name.encode()
+            names.extend(encoded)
+            return len(names) - len(encoded), len(encoded)
+
+        states = [state for entity in self.entities for state in entity["states"]]
+        entity_table = np.zeros(len(self.entities), dtype=ENTITY_DTYPE)
+        state_table = np.zeros(len(states), dtype=STATE_DTYPE)
+        first_state = first_entry = 0
+        for entity_index, entity in enumerate(self.entities):
+            entity_table[entity_index] = (*add_name(entity["name"]), entity["sprite_width"], entity["sprite_height"], first_state, len(entity["states"]))
+            for state in entity["states"]:
+                state_table[first_state] = (*add_name(state["name"]), first_entry, len(state["frames"]))
+                first_state += 1
+                first_entry += len(state["frames"])
+        entry_table = np.array([tuple(entry) for state in states for entry in state["frames"]], dtype=ENTRY_DTYPE)
+        header = struct.pack(
+            HEADER_FORMAT, ATLAS_INDEX_MAGIC, ATLAS_INDEX_VERSION, len(self.pages), self.page_width, self.page_height,
+            len(self.frames), len(entity_table), len(state_table), len(entry_table), len(names)
+        )
+        return b"".join([header, self.frames.tobytes(), entity_table.tobytes(), state_table.tobytes(), entry_table.tobytes(), bytes(names)])
+
+    def save(self, folder_path, binary=False, workers=SAVE_WORKERS):
+        # Writes page_<n>.png, atlas.json and with binary=True atlas.bin holding the same index
+        os.makedirs(folder_path, exist_ok=True)
+        jobs = [
+            (os.path.join(folder_path, self.page_file_name(page_index)), self.page_width, self.page_height, pygame.image.tobytes(page, "RGBA"))
+            for page_index, page in enumerate(self.pages)
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(write_save_job, jobs))
+        with open(os.path.join(folder_path, "atlas.json"), 'w') as file:
+            json.dump(self.index(), file)
+        if binary:
+            with open(os.path.join(folder_path, "atlas.bin"), 'wb') as file:
+                file.write(self.index_bytes())
+
+def load_atlas_index(file_path):
+    # Reads atlas.json or atlas.bin into the dict TextureAtlas.index() returns
+    if not file_path.endswith(".bin"):
+        with open(file_path, 'r') as file:
+            return json.load(file)
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    magic, version, page_count, page_width, page_height, frame_count, entity_count, state_count, entry_count, names_size = \
+        struct.unpack_from(HEADER_FORMAT, data)
+    if magic != ATLAS_INDEX_MAGIC or version != ATLAS_INDEX_VERSION:
+        raise ValueError(f"{file_path} is not a version {ATLAS_INDEX_VERSION} atlas index")
+    offset = struct.calcsize(HEADER_FORMAT)
+    tables = []
+    for dtype, count in ((FRAME_DTYPE, frame_count), (ENTITY_DTYPE, entity_count), (STATE_DTYPE, state_count), (ENTRY_DTYPE, entry_count)):
+        tables.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+        offset += dtype.itemsize * count
+    frames, entity_table, state_table, entry_table = tables
+    names = data[offset:offset + names_size]
+    name = lambda row: names[row["name_offset"]:row["name_offset"] + row["name_length"]].decode()
+    entities = []
+    for entity in entity_table:
+        states = []
+        for state in state_table[entity["first_state"]:entity["first_state"] + entity["state_count"]]:
+            entries = entry_table[state["first_entry"]:state["first_entry"] + state["entry_count"]]
+            states.append({"name": name(state), "frames": [list(entry) for entry in entries.tolist()]})
+        entities.append({"name": name(entity), "sprite_width": int(entity["sprite_width"]), "sprite_height": int(entity["sprite_height"]), "states": states})
+    return {
+        "version": version,
+        "page_width": page_width,
+        "page_height": page_height,
+        "pages": [f"page_{page_index}.png" for page_index in range(page_count)],
+        "frames": [
+            {"page": page, "x": x, "y": y, "width": width, "height": height, "rotated": bool(rotated), "uv": uv}
+            for page, rotated, x, y, width, height, uv in zip(*(frames[field].tolist() for field in ("page", "rotated", "x", "y", "width", "height", "uv")))
+        ],
+        "entities": entities
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack the frames of saved sprite entities into shared texture atlas pages.")
+    parser.add_argument("inputs", nargs="+", help="Saved entity folders or metadata.json files, globs are expanded")
+    parser.add_argument("-o", "--output", required=True, help="Folder for the pages and the frame index")
+    parser.add_argument("--page-size", default="2048x2048", help="Page size, e.g. 4096x4096")
+    parser.add_argument("--padding", type=int, default=1, help="Transparent pixels around every frame")
+    parser.add_argument("--rotate", action="store_true", help="Allow frames to be stored turned 90 degrees")
+    parser.add_argument("--binary", action="store_true", help="Also write the index as atlas.bin")
+    args = parser.parse_args(argv)
+
+    init_headless_display()
+    page_width, page_height = map(int, args.page_size.lower().split("x"))
+    start = time.perf_counter()
+    sprite_entities = [SpriteEntity.load_from_file(file_path, lazy=True) for file_path in collect_entity_files(args.inputs)]
+    loaded = time.perf_counter()
+    atlas = TextureAtlas.pack(sprite_entities, page_width, page_height, args.padding, args.rotate)
+    packed = time.perf_counter()
+    atlas.save(args.output, args.binary)
+    frame_count = sum(len(state["frames"]) for entity in atlas.entities for state in entity["states"])
+    used_area = int((atlas.frames["width"].astype(np.int64) * atlas.frames["height"]).sum())
+    print(f"Packed {frame_count} frames ({len(atlas.frames)} unique) of {len(sprite_entities)} entities into "
+          f"{len(atlas.pages)} {page_width}x{page_height} pages, {used_area / max(len(atlas.pages) * page_width * page_height, 1):.1%} filled")
+    print(f"Loaded in {loaded - start:.2f}s, packed in {packed - loaded:.2f}s, saved in {time.perf_counter() - packed:.2f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
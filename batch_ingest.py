@@ -0,0 +1,262 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from headless import init_headless_display
+from png_encoder import write_file_atomic
+from preview_export import export_entity_previews
+from spritesheet_visualizer import ATLAS_FORMATS, DEFAULT_OUTPUT_FOLDER, FrameStore
+from sprite_catalog import CATALOG_FILE_NAME, SpriteCatalog
+from sprite_index import SpriteIndex, entity_embeddings
+
+FRAME_SIZE_PATTERN = re.compile(r"(\d+)x(\d+)")
+MANIFEST_FILE_NAME = "ingest_manifest.json"
+MANIFEST_VERSION = 1
+
+def parse_frame_size(text):
+    match = FRAME_SIZE_PATTERN.fullmatch(text.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"Invalid frame size '{text}', expected WIDTHxHEIGHT")
+    return int(match.group(1)), int(match.group(2))
+
+def load_frame_sizes(file_path):
+    # Maps spritesheet file names to "WIDTHxHEIGHT" strings or [width, height] pairs
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+    return {
+        name: parse_frame_size(size) if isinstance(size, str) else (int(size[0]), int(size[1]))
+        for name, size in data.items()
+    }
+
+def infer_frame_size(spritesheet_path, frame_sizes, default_size):
+    file_name = os.path.basename(spritesheet_path)
+    if file_name in frame_sizes:
+        return frame_sizes[file_name]
+    matches = FRAME_SIZE_PATTERN.findall(os.path.splitext(file_name)[0])
+    if matches:
+        return int(matches[-1][0]), int(matches[-1][1])
+    return default_size
+
+def collect_spritesheets(inputs):
+    spritesheet_paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "*.png"))
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        spritesheet_paths.extend(path for path in sorted(matches) if path.endswith(".png"))
+    return list(dict.fromkeys(spritesheet_paths))
+
+def file_hash(file_path):
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+def load_manifest(output_folder):
+    # Maps entity names to the source, slicing parameters and output hashes they were last ingested with
+    try:
+        with open(os.path.join(output_folder, MANIFEST_FILE_NAME), 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return manifest["entities"] if manifest.get("version") == MANIFEST_VERSION else {}
+
+def save_manifest(output_folder, entries):
+    os.makedirs(output_folder, exist_ok=True)
+    data = json.dumps({"version": MANIFEST_VERSION, "entities": entries}, indent=4, sort_keys=True)
+    write_file_atomic(os.path.join(output_folder, MANIFEST_FILE_NAME), data.encode())
+
+def source_fingerprint(spritesheet_path, entry=None):
+    # Returns (size, mtime_ns, content hash), the file is only read when its size or mtime differ from the entry
+    stat = os.stat(spritesheet_path)
+    if entry is not None and entry["source_size"] == stat.st_size and entry["source_mtime_ns"] == stat.st_mtime_ns:
+        return stat.st_size, stat.st_mtime_ns, entry["source_hash"]
+    return stat.st_size, stat.st_mtime_ns, file_hash(spritesheet_path)
+
+def entity_output_names(folder_path):
+    # metadata.json and the files it refers to
+    with open(os.path.join(folder_path, "metadata.json"), 'r') as file:
+        data = json.load(file)
+    names = {"metadata.json"}
+    if data.get("atlas_url"):
+        names.add(os.path.basename(data["atlas_url"]))
+    for state in data["states"]:
+        for sprite in state["sprites"]:
+            if sprite.get("image_url"):
+                names.add(os.path.basename(sprite["image_url"]))
+    return names
+
+def outputs_intact(folder_path, outputs, verify=False):
+    # Existence is enough to skip a sheet, verify=True also compares every output's hash
+    for name, output_hash in outputs.items():
+        file_path = os.path.join(folder_path, name)
+        if not os.path.exists(file_path) or (verify and file_hash(file_path) != output_hash):
+            return False
+    return True
+
+def ingest_spritesheet(spritesheet_path, sprite_width, sprite_height, output_folder, atlas_format=None, embed=False, trim=False, preview_folder=None):
+    # Embeddings are computed here while the frames are decoded, the parent only appends them to the index
+    sprite_entity = FrameStore.load_from_spritesheet(spritesheet_path, sprite_width, sprite_height, trim=trim)
+    dedup_stats = sprite_entity.dedup_stats()
+    embeddings = entity_embeddings(sprite_entity) if embed else None
+    folder_path = os.path.join(output_folder, sprite_entity.name)
+    # The process pool already keeps every core busy, a writer thread pool per worker would only oversubscribe them
+    sprite_entity.save_to_file(folder_path, atlas_format, os.path.join(output_folder, CATALOG_FILE_NAME), workers=1)
+    # Frames of an earlier slicing that this one no longer writes would otherwise linger in the folder
+    output_names = entity_output_names(folder_path)
+    for name in os.listdir(folder_path):
+        if name not in output_names:
+            os.remove(os.path.join(folder_path, name))
+    outputs = {name: file_hash(os.path.join(folder_path, name)) for name in sorted(output_names)}
+    if preview_folder is not None:
+        # The frames are still decoded here, exporting later would load the saved entity again
+        preview_path = os.path.join(preview_folder, sprite_entity.name)
+        shutil.rmtree(preview_path, ignore_errors=True)
+        export_entity_previews(sprite_entity, preview_path)
+    return dedup_stats, embeddings, outputs
+
+def remove_entities(output_folder, entries):
+    # Deletes the saved folders of the manifest entries and drops them from the catalog and the indexes they were added to
+    catalog_path = os.path.join(output_folder, CATALOG_FILE_NAME)
+    if os.path.exists(catalog_path):
+        with SpriteCatalog(catalog_path) as catalog:
+            for name in entries:
+                catalog.remove(name)
+    index_folders = {}
+    for name, entry in entries.items():
+        shutil.rmtree(os.path.join(output_folder, name), ignore_errors=True)
+        if entry["params"].get("previews") is not None:
+            shutil.rmtree(os.path.join(entry["params"]["previews"], name), ignore_errors=True)
+        if entry["params"]["index"] is not None:
+            index_folders.setdefault(entry["params"]["index"], []).append(name)
+    for index_folder, names in index_folders.items():
+        if os.path.isdir(index_folder):
+            sprite_index = SpriteIndex(index_folder)
+            sprite_index.remove_entities(names)
+            sprite_index.save()
+
+def batch_ingest(spritesheet_paths, output_folder, frame_sizes=None, default_size=None, workers=None, atlas_format=None, index_folder=None, trim=False, force=False, verify=False, preview_folder=None):
+    # Returns (stats, failures) where stats sums FrameStore.dedup_stats of the sheets sliced in this run, counts the
+    # "skipped" unchanged sheets and the "removed" entities whose sources are gone, and failures maps spritesheet paths
+    # to error messages. force=True re-ingests every sheet, verify=True re-hashes outputs before trusting them.
+    # With a preview_folder every sliced sheet also gets the default previews of preview_export.
+    frame_sizes = frame_sizes or {}
+    failures = {}
+    stats = {"frames": 0, "unique_frames": 0, "bytes": 0, "bytes_saved": 0, "skipped": 0, "removed": 0}
+    manifest = load_manifest(output_folder)
+    embeddings = []
+    jobs = {}
+    entity_names = {}
+    for spritesheet_path in spritesheet_paths:
+        # Sheets without a known frame size have their grid detected by the worker
+        frame_size = infer_frame_size(spritesheet_path, frame_sizes, default_size) or (None, None)
+        entity_name = os.path.splitext(os.path.basename(spritesheet_path))[0]
+        if entity_name in entity_names:
+            failures[spritesheet_path] = f"Output name '{entity_name}' already used by {entity_names[entity_name]}"
+            continue
+        entity_names[entity_name] = spritesheet_path
+        source = os.path.abspath(spritesheet_path)
+        params = {
+            "sprite_width": frame_size[0], "sprite_height": frame_size[1], "trim": trim, "atlas_format": atlas_format,
+            "index": os.path.abspath(index_folder) if index_folder is not None else None,
+            "previews": os.path.abspath(preview_folder) if preview_folder is not None else None
+        }
+        entry = manifest.get(entity_name)
+        if entry is not None and entry["source"] != source:
+            entry = None
+        try:
+            source_size, source_mtime_ns, source_hash = source_fingerprint(spritesheet_path, entry)
+        except OSError as e:
+            failures[spritesheet_path] = f"{type(e).__name__}: {e}"
+            continue
+        fingerprint = {"source": source, "source_size": source_size, "source_mtime_ns": source_mtime_ns, "source_hash": source_hash, "params": params}
+        if not force and entry is not None and entry["source_hash"] == source_hash and entry["params"] == params and \
+                outputs_intact(os.path.join(output_folder, entity_name), entry["outputs"], verify):
+            # A touched but unchanged sheet is hashed once, the new mtime spares the next run that
+            entry.update(fingerprint)
+            stats["skipped"] += 1
+            continue
+        jobs[spritesheet_path] = frame_size, entity_name, fingerprint
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_headless_display) as executor:
+        futures = {
+            executor.submit(ingest_spritesheet, spritesheet_path, sprite_width, sprite_height, output_folder, atlas_format, index_folder is not None, trim, preview_folder): spritesheet_path
+            for spritesheet_path, ((sprite_width, sprite_height), _, _) in jobs.items()
+        }
+        for future in as_completed(futures):
+            spritesheet_path = futures[future]
+            _, entity_name, fingerprint = jobs[spritesheet_path]
+            try:
+                dedup_stats, entity_embedding, outputs = future.result()
+                for key, value in dedup_stats.items():
+                    stats[key] += value
+                if entity_embedding is not None:
+                    embeddings.append(entity_embedding)
+                manifest[entity_name] = dict(fingerprint, outputs=outputs, stats=dedup_stats)
+            except Exception as e:
+                # Without an entry the next run retries the sheet instead of trusting its old outputs
+                manifest.pop(entity_name, None)
+                failures[spritesheet_path] = f"{type(e).__name__}: {e}"
+    # Sources that are gone take their outputs with them, sheets merely left out of this run are kept
+    removed = {name: entry for name, entry in manifest.items() if not os.path.exists(entry["source"])}
+    if removed:
+        remove_entities(output_folder, removed)
+        for name in removed:
+            del manifest[name]
+        stats["removed"] = len(removed)
+    save_manifest(output_folder, manifest)
+    if index_folder is not None and embeddings:
+        sprite_index = SpriteIndex(index_folder)
+        sprite_index.add_embeddings(embeddings)
+        sprite_index.build_index()
+        sprite_index.save()
+    return stats, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Slice folders of spritesheets into saved sprite entities without a display.")
+    parser.add_argument("inputs", nargs="+", help="Spritesheet folders, files or glob patterns")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_FOLDER, help="Folder the sprite entities are saved to")
+    parser.add_argument("--size", type=parse_frame_size, default=None, help="Frame size used when none is found for a file, e.g. 288x128 (detected from the sheet when omitted)")
+    parser.add_argument("--sizes", default=None, help="JSON file mapping spritesheet file names to frame sizes")
+    parser.add_argument("--atlas", choices=ATLAS_FORMATS, default=None, help="Store each entity as one packed atlas instead of a PNG per frame")
+    parser.add_argument("--trim", action="store_true", help="Store each frame cropped to its opaque pixels plus its offset in the cell")
+    parser.add_argument("--index", default=None, help="Also add the entities to the visual similarity index in this folder")
+    parser.add_argument("--previews", default=None, help="Also write animated previews and a contact sheet of each entity to this folder")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (defaults to the CPU count)")
+    parser.add_argument("--force", action="store_true", help="Re-ingest every sheet, even those unchanged since the last run")
+    parser.add_argument("--verify", action="store_true", help="Re-hash the saved outputs of unchanged sheets instead of trusting that they exist")
+    args = parser.parse_args(argv)
+
+    spritesheet_paths = collect_spritesheets(args.inputs)
+    if not spritesheet_paths:
+        print("No spritesheets found")
+        return 1
+    frame_sizes = load_frame_sizes(args.sizes) if args.sizes else {}
+
+    start = time.perf_counter()
+    stats, failures = batch_ingest(spritesheet_paths, args.output, frame_sizes, args.size, args.workers, args.atlas, args.index, args.trim, args.force, args.verify, args.previews)
+    elapsed = time.perf_counter() - start
+
+    ingested = len(spritesheet_paths) - len(failures) - stats["skipped"]
+    frame_count = stats["frames"]
+    print(f"Ingested {ingested}/{len(spritesheet_paths)} spritesheets ({frame_count} frames) in {elapsed:.2f}s, "
+          f"{stats['skipped']} unchanged skipped, {stats['removed']} removed with their sources")
+    if ingested:
+        print(f"Throughput: {ingested / elapsed:.2f} sheets/s, {frame_count / elapsed:.1f} frames/s")
+        print(f"Unique frames: {stats['unique_frames']}/{frame_count}, duplicates saved {stats['bytes_saved'] / 2**20:.1f}MB of {stats['bytes'] / 2**20:.1f}MB decoded")
+    for spritesheet_path, error in sorted(failures.items()):
+        print(f"FAILED {spritesheet_path}: {error}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+from playback_engine import PlaybackEngine
+from spritesheet_visualizer import FrameStore, SpriteEntity, SpriteManager, decoded_image_cache, detect_sprite_grid
+from synthetic_sheets import make_synthetic_sheet
+
+RAW_SPRITES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw_sprites")
+DEFAULT_SYNTHETIC = ("1024x1024:32x32:0.3", "2304x1280:288x128:0.2", "4096x4096:64x64:0.6")
+SCREEN_SIZE = (1920, 1000)
+PLAYBACK_INSTANCES = 1000
+PLAYBACK_FRAMES = 10
+
+def parse_synthetic(text):
+    # SHEETWxSHEETH:CELLWxCELLH:SPARSITY, sparsity being the fraction of empty cells
+    try:
+        sheet_size, cell_size, sparsity = text.split(":")
+        sheet_width, sheet_height = map(int, sheet_size.lower().split("x"))
+        cell_width, cell_height = map(int, cell_size.lower().split("x"))
+        return sheet_width, sheet_height, cell_width, cell_height, float(sparsity)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid synthetic sheet '{text}', expected e.g. 2048x2048:64x64:0.5")
+
+def read_rss_kb(field):
+    try:
+        with open("/proc/self/status", 'r') as file:
+            for line in file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    # Linux resets VmHWM to the current RSS when 5 is written to clear_refs
+    try:
+        with open("/proc/self/clear_refs", 'w') as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+def measure(stage, repeat, setup=None):
+    # Runs stage() repeat times and returns min/median seconds and the peak RSS growth of the runs in MB
+    times = []
+    peak_mb = None
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        gc.collect()
+        resettable = reset_peak_rss()
+        rss_before = read_rss_kb("VmRSS")
+        start = time.perf_counter()
+        stage(argument) if setup is not None else stage()
+        times.append(time.perf_counter() - start)
+        peak = read_rss_kb("VmHWM")
+        if resettable and peak is not None and rss_before is not None:
+            peak_mb = max(peak_mb or 0, (peak - rss_before) / 1024)
+    return {"min_ms": min(times) * 1000, "median_ms": statistics.median(times) * 1000, "peak_mb": peak_mb}
+
+def benchmark_sheet(spritesheet_path, sprite_width, sprite_height, repeat, work_folder):
+    results = {}
+    decode = lambda: pygame.image.load(spritesheet_path).convert_alpha()
+    results["decode"] = measure(decode, repeat)
+    spritesheet = decode()
+    results["detect_grid"] = measure(lambda: detect_sprite_grid(spritesheet), repeat)
+    if sprite_width is None or sprite_height is None:
+        grid = detect_sprite_grid(spritesheet)
+        sprite_width, sprite_height = grid.sprite_width, grid.sprite_height
+    slice_sheet = lambda trim=False: SpriteEntity.from_spritesheet(spritesheet, spritesheet_path, sprite_width, sprite_height, trim=trim)
+    results["slice"] = measure(slice_sheet, repeat)
+    results["slice_trimmed"] = measure(lambda: slice_sheet(True), repeat)
+    results["slice_compact"] = measure(lambda: FrameStore.from_spritesheet(spritesheet, spritesheet_path, sprite_width, sprite_height), repeat)
+    sprite_entity = slice_sheet()
+
+    for name, atlas_format in (("png", None), ("atlas_png", "png"), ("atlas_rgba", "rgba")):
+        folder_path = os.path.join(work_folder, name)
+
+        def empty_folder():
+            shutil.rmtree(folder_path, ignore_errors=True)
+            return folder_path
+
+        results[f"save_{name}"] = measure(lambda folder: sprite_entity.save_to_file(folder, atlas_format), repeat, empty_folder)
+        metadata_path = os.path.join(folder_path, "metadata.json")
+        results[f"load_{name}"] = measure(lambda: SpriteEntity.load_from_file(metadata_path), repeat)
+    results["load_png_lazy"] = measure(lambda: SpriteEntity.load_from_file(os.path.join(work_folder, "png", "metadata.json"), lazy=True), repeat)
+
+    screen = pygame.display.get_surface()
+    sprite_manager = SpriteManager(spritesheet_path, sprite_width, sprite_height)
+    # Neighbour prefetching would slice other sheets in the background while the render stages are timed
+    sprite_manager.loader.executor.shutdown(wait=True, cancel_futures=True)
+    sprite_manager.set_sprite_entity(sprite_entity)
+
+    def cold_render():
+        sprite_manager.spritesheet_grid = None
+        sprite_manager.scaled_surface_cache.clear()
+        sprite_manager.text_cache.surfaces.clear()
+        sprite_manager.render(screen)
+
+    results["render_cold"] = measure(cold_render, repeat)
+    results["render_full"] = measure(lambda: sprite_manager.render(screen), repeat)
+
+    def frame_updates():
+        # One pass over every frame of the first state through the dirty rect path
+        state = sprite_entity.states[0]
+        for sprite_index in range(len(state.sprites)):
+            sprite_manager.current_sprite_index = sprite_index
+            if sprite_manager.render_frame_update(screen) is None:
+                sprite_manager.render(screen)
+
+    sprite_manager.render(screen)
+    results["render_frame_updates"] = measure(frame_updates, repeat)
+    results["render_frame_updates"]["frames"] = len(sprite_entity.states[0].sprites)
+
+    engine = PlaybackEngine()
+    engine.add_entity(sprite_entity)
+    engine.spawn_random(PLAYBACK_INSTANCES, SCREEN_SIZE)
+
+    def playback_frames():
+        for _ in range(PLAYBACK_FRAMES):
+            engine.update(1 / 60)
+            screen.fill((0, 0, 0))
+            engine.draw(screen)
+
+    results["playback"] = measure(playback_frames, repeat)
+    results["playback"].update(frames=PLAYBACK_FRAMES, instances=PLAYBACK_INSTANCES)
+    decoded_image_cache.clear()
+
+    frame_count = sum(len(state.sprites) for state in sprite_entity.states)
+    return {
+        "sheet_size": list(spritesheet.get_size()),
+        "sprite_size": [sprite_width, sprite_height],
+        "frames": frame_count,
+        "stages": results
+    }
+
+def run_benchmarks(synthetic, raw_sprites=True, repeat=3, seed=0):
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode(SCREEN_SIZE)
+    work_folder = tempfile.mkdtemp(prefix="spritestash_bench_")
+    sheets = {}
+    try:
+        for index, (sheet_width, sheet_height, cell_width, cell_height, sparsity) in enumerate(synthetic):
+            name = f"synthetic_{sheet_width}x{sheet_height}_{cell_width}x{cell_height}_{sparsity:g}"
+            # Each sheet sits in its own folder so SpriteManager doesn't prefetch the others
+            sheet_folder = os.path.join(work_folder, "sheets", name)
+            os.makedirs(sheet_folder)
+            spritesheet_path = os.path.join(sheet_folder, name + ".png")
+            pygame.image.save(make_synthetic_sheet(sheet_width, sheet_height, cell_width, cell_height, sparsity, seed + index), spritesheet_path)
+            sheets[name] = benchmark_sheet(spritesheet_path, cell_width, cell_height, repeat, os.path.join(work_folder, "out", name))
+        if raw_sprites:
+            for spritesheet_path in sorted(glob.glob(os.path.join(RAW_SPRITES_FOLDER, "*.png"))):
+                name = os.path.splitext(os.path.basename(spritesheet_path))[0]
+                sheets[name] = benchmark_sheet(spritesheet_path, None, None, repeat, os.path.join(work_folder, "out", name))
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine()
+        },
+        "repeat": repeat,
+        "seed": seed,
+        "sheets": sheets
+    }
+
+def compare_results(results, baseline, threshold=1.25, min_ms=1.0):
+    # Returns (stage, baseline ms, current ms, ratio, regressed) for every stage present in both, regressed
+    # when the ratio exceeds threshold. Stages faster than min_ms in both runs are skipped as timer noise
+    comparisons = []
+    for sheet_name, sheet in results["sheets"].items():
+        baseline_sheet = baseline["sheets"].get(sheet_name)
+        if baseline_sheet is None:
+            continue
+        for stage_name, stage in sheet["stages"].items():
+            baseline_stage = baseline_sheet["stages"].get(stage_name)
+            if baseline_stage is None or max(stage["min_ms"], baseline_stage["min_ms"]) < min_ms:
+                continue
+            ratio = stage["min_ms"] / max(baseline_stage["min_ms"], 1e-9)
+            comparisons.append((f"{sheet_name}/{stage_name}", baseline_stage["min_ms"], stage["min_ms"], ratio, ratio > threshold))
+    return comparisons
+
+def print_results(results):
+    for sheet_name, sheet in results["sheets"].items():
+        print(f"{sheet_name}  {sheet['sheet_size'][0]}x{sheet['sheet_size'][1]}  {sheet['sprite_size'][0]}x{sheet['sprite_size'][1]}  {sheet['frames']} frames")
+        for stage_name, stage in sheet["stages"].items():
+            peak = f"{stage['peak_mb']:8.1f}MB" if stage["peak_mb"] is not None else "       n/a"
+            print(f"    {stage_name:<22}{stage['min_ms']:10.2f}ms min {stage['median_ms']:10.2f}ms median {peak} peak")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmarks for slicing, saving, loading and rendering sprite entities.")
+    parser.add_argument("--synthetic", type=parse_synthetic, nargs="*", default=None,
+                        help=f"Synthetic sheets as SHEETWxSHEETH:CELLWxCELLH:SPARSITY (default {' '.join(DEFAULT_SYNTHETIC)})")
+    parser.add_argument("--no-raw-sprites", action="store_true", help="Skip the bundled raw_sprites sheets")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per stage, the fastest is compared")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="Compare against results previously written with -o")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    synthetic = args.synthetic if args.synthetic is not None else [parse_synthetic(text) for text in DEFAULT_SYNTHETIC]
+    results = run_benchmarks(synthetic, not args.no_raw_sprites, args.repeat, args.seed)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = 0
+        print(f"\nCompared with {args.baseline}:")
+        for stage_name, baseline_ms, current_ms, ratio, regressed in compare_results(results, baseline, args.threshold):
+            regressions += regressed
+            print(f"    {'REGRESSION' if regressed else '':<11}{stage_name:<70}{baseline_ms:10.2f}ms -> {current_ms:10.2f}ms  x{ratio:.2f}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pygame
+
+# The viewer loop laps its phases itself, these SpriteManager methods are timed within them
+PROFILED_METHODS = (
+    "render_preview", "render_text", "render_spritesheet", "compose_spritesheet",
+    "render_selection_border", "render_text_boxes", "render_input_boxes", "render_play_pause_button",
+    "render_speed_control_buttons", "render_navigation_buttons", "render_error_message",
+    "handle_key_events", "handle_mouse_events"
+)
+HISTOGRAM_BIN_MS = 2
+HISTOGRAM_BINS = 17  # The last bin collects every frame slower than 32ms
+OVERLAY_REFRESH = 0.25  # Seconds between rebuilds of the overlay text
+
+class FrameProfiler:
+    # Only exists while profiling is on, the viewer loop checks for None and
+    # instrumented methods are instance attributes removed again by uninstrument()
+    def __init__(self, window=600, trace_path=None):
+        self.window = window
+        self.trace_path = trace_path
+        self.trace_events = [] if trace_path else None
+        self.origin = time.perf_counter()
+        self.samples = {}
+        self.frame_times = deque(maxlen=window)
+        self.frame_start = None
+        self.lap_start = None
+        self.instrumented = []
+        self.overlay = None
+        self.overlay_time = 0
+        self.font = None
+
+    def record(self, name, start, end):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append((end - start) * 1000)
+        if self.trace_events is not None:
+            self.trace_events.append({
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6
+            })
+
+    def start_frame(self):
+        self.frame_start = self.lap_start = time.perf_counter()
+
+    def lap(self, name):
+        # Records the time since the previous lap (or the start of the frame) under name
+        now = time.perf_counter()
+        self.record(name, self.lap_start, now)
+        self.lap_start = now
+
+    def end_frame(self):
+        now = time.perf_counter()
+        self.record("frame", self.frame_start, now)
+        self.frame_times.append((now - self.frame_start) * 1000)
+
+    def timed(self, name, method):
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+        return timed_method
+
+    def instrument(self, obj, method_names=PROFILED_METHODS):
+        for name in method_names:
+            setattr(obj, name, self.timed(name, getattr(obj, name)))
+            self.instrumented.append((obj, name))
+
+    def uninstrument(self):
+        for obj, name in self.instrumented:
+            delattr(obj, name)
+        self.instrumented = []
+
+    def percentiles(self):
+        # Returns {phase: (p50, p95, p99, max)} in ms over the rolling window
+        stats = {}
+        for name, samples in self.samples.items():
+            values = np.fromiter(samples, dtype=np.float64, count=len(samples))
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            stats[name] = (p50, p95, p99, values.max())
+        return stats
+
+    def render_overlay(self, screen, text_cache, position=None):
+        # Draws an opaque panel and returns its rect so dirty rect updates can include it
+        now = time.perf_counter()
+        if self.overlay is None or now - self.overlay_time >= OVERLAY_REFRESH:
+            self.overlay = self.compose_overlay(text_cache)
+            self.overlay_time = now
+        if position is None:
+            position = (10, screen.get_height() - self.overlay.get_height() - 10)
+        return screen.blit(self.overlay, position)
+
+    def compose_overlay(self, text_cache):
+        stats = self.percentiles()
+        names = ["frame"] + sorted((name for name in stats if name != "frame"), key=lambda name: -stats[name][1])
+        rows = [("phase ms", "p50", "p95", "p99", "max")]
+        rows.extend((name, *(f"{value:.2f}" for value in stats[name])) for name in names if name in stats)
+        line_height = 16
+        histogram_height = 60
+        width = 460
+        overlay = pygame.Surface((width, histogram_height + 30 + line_height * len(rows))).convert()
+        overlay.fill((24, 24, 24))
+
+        counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        if self.frame_times:
+            bins = np.minimum(np.fromiter(self.frame_times, dtype=np.float64) // HISTOGRAM_BIN_MS, HISTOGRAM_BINS - 1).astype(np.int64)
+            counts = np.bincount(bins, minlength=HISTOGRAM_BINS)
+        bar_width = (width - 20) // HISTOGRAM_BINS
+        for index, count in enumerate(counts):
+            height = int(histogram_height * count / max(counts.max(), 1))
+            # Bins past a 60 FPS frame budget are drawn red
+            color = (90, 200, 90) if (index + 1) * HISTOGRAM_BIN_MS <= 1000 / 60 else (220, 80, 80)
+            pygame.draw.rect(overlay, color, (10 + index * bar_width, 10 + histogram_height - height, bar_width - 2, height))
+        overlay.blit(text_cache.render(f"frame time, {HISTOGRAM_BIN_MS}ms bins, last bin >{HISTOGRAM_BIN_MS * (HISTOGRAM_BINS - 1)}ms", 16, (200, 200, 200)), (10, histogram_height + 12))
+
+        # The numbers change on every refresh, render them with a font of our own instead of filling the shared text cache
+        if self.font is None:
+            self.font = pygame.font.Font(None, 18)
+        for index, row in enumerate(rows):
+            y = histogram_height + 30 + index * line_height
+            overlay.blit(self.font.render(row[0], True, (230, 230, 230)), (10, y))
+            for column, value in enumerate(row[1:]):
+                value_surface = self.font.render(value, True, (230, 230, 230))
+                overlay.blit(value_surface, value_surface.get_rect(topright=(250 + column * 65, y)))
+        return overlay
+
+    def save_trace(self, trace_path=None):
+        # Chrome trace event format, open with chrome://tracing or ui.perfetto.dev
+        trace_path = trace_path or self.trace_path
+        if trace_path is None or self.trace_events is None:
+            return
+        with open(trace_path, 'w') as file:
+            json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, file)
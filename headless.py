@@ -0,0 +1,10 @@
+import os
+
+import pygame
+
+def init_headless_display():
+    # convert_alpha needs a display surface, the dummy driver provides one without a window. Also the initializer
+    # of the worker processes that slice and export sheets.
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
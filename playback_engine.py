@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pygame
+from frame_profiler import FrameProfiler
+from spritesheet_visualizer import SpriteEntity, TextCache
+from sprite_index import collect_entity_files
+
+DEFAULT_COUNTS = (100, 500, 1000, 2000, 5000)
+FRAME_RATE = 5  # Frames per second at speed 1, like the viewer's frame timer
+BACKGROUND_COLOR = (0, 0, 0)
+
+class PlaybackEngine:
+    # Animates many instances of many entities at once. Every state of every added entity is a range in flat frame
+    # tables, and every instance is a row in parallel arrays (state, frame, clock, speed, position), so update() is a
+    # few numpy operations and draw() a single Surface.blits call whatever the instance count.
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self.entity_names = []
+        self.entity_first_state = []  # First global state of every entity
+        self.images = []  # Scaled unique frames cropped to their opaque pixels, drawn as they are
+        self.image_offsets = []  # Top left of the crop in the scaled frame
+        self.image_indices = {}
+        self.frame_image = np.zeros(0, dtype=np.int32)  # (frames,) index into images
+        self.frame_offset = np.zeros((0, 2), dtype=np.int32)  # (frames, 2) placement of the frame in its scaled cell
+        self.state_first = np.zeros(0, dtype=np.int32)  # (states,) first frame of every state
+        self.state_length = np.zeros(0, dtype=np.int32)
+        self.state_cell_size = np.zeros((0, 2), dtype=np.int32)  # Scaled cell of the state's entity, it bounds every frame
+        self.state = np.zeros(0, dtype=np.int32)
+        self.frame = np.zeros(0, dtype=np.int32)
+        self.clock = np.zeros(0, dtype=np.float64)  # Progress towards the next frame, in frames
+        self.speed = np.zeros(0, dtype=np.float64)
+        self.position = np.zeros((0, 2), dtype=np.int32)  # Top left of the instance's scaled cell
+
+    def add_entity(self, sprite_entity):
+        # Takes a SpriteEntity or FrameStore and returns its entity index. Frames with the same pixels are scaled
+        # and cropped once, across all entities. Blending costs per pixel, and most of a cell is usually transparent.
+        cell_size = (sprite_entity.sprite_width, sprite_entity.sprite_height)
+        if not cell_size[0] or not cell_size[1]:
+            sizes = [sprite.get_image().get_size() for state in sprite_entity.states for sprite in state.sprites] or [(1, 1)]
+            cell_size = (max(width for width, _ in sizes), max(height for _, height in sizes))
+        target_size = (max(1, round(cell_size[0] * self.scale)), max(1, round(cell_size[1] * self.scale)))
+        frame_images = []
+        frame_offsets = []
+        state_lengths = [len(state.sprites) for state in sprite_entity.states]
+        for state in sprite_entity.states:
+            for sprite in state.sprites:
+                image = sprite.get_image()
+                image_size, offset = sprite.placement(cell_size, target_size)
+                key = (sprite.content_hash or id(image), image_size)
+                image_index = self.image_indices.get(key)
+                if image_index is None:
+                    if image_size != image.get_size():
+                        image = pygame.transform.scale(image, (max(1, image_size[0]), max(1, image_size[1])))
+                    bounds = image.get_bounding_rect()
+                    if bounds.size != image.get_size():
+                        image = image.subsurface(bounds).copy()
+                    image_index = self.image_indices[key] = len(self.images)
+                    self.images.append(image)
+                    self.image_offsets.append(bounds.topleft)
+                crop_x, crop_y = self.image_offsets[image_index]
+                frame_images.append(image_index)
+                frame_offsets.append((offset[0] + crop_x, offset[1] + crop_y))
+        self.entity_names.append(sprite_entity.name)
+        self.entity_first_state.append(len(self.state_length))
+        first_frames = len(self.frame_image) + np.cumsum([0] + state_lengths[:-1])
+        self.state_first = np.concatenate([self.state_first, first_frames]).astype(np.int32)
+        self.state_length = np.concatenate([self.state_length, state_lengths]).astype(np.int32)
+        self.state_cell_size = np.concatenate([self.state_cell_size, np.tile(np.array(target_size, dtype=np.int32), (len(state_lengths), 1))])
+        self.frame_image = np.concatenate([self.frame_image, frame_images]).astype(np.int32)
+        self.frame_offset = np.concatenate([self.frame_offset, np.array(frame_offsets, dtype=np.int32).reshape(-1, 2)])
+        return len(self.entity_names) - 1
+
+    def state_id(self, entity_index, state_index):
+        return self.entity_first_state[entity_index] + state_index
+
+    def add_instances(self, states, positions, speeds=1.0, frames=0):
+        # states are global state ids (see state_id), returns the indexes of the new instances
+        states = np.asarray(states, dtype=np.int32).reshape(-1)
+        if np.any(self.state_length[states] == 0):
+            raise ValueError("Instances can't play a state without frames")
+        count = len(states)
+        first = len(self.state)
+        self.state = np.concatenate([self.state, states])
+        self.frame = np.concatenate([self.frame, np.broadcast_to(np.asarray(frames, dtype=np.int32), (count,)) % self.state_length[states]])
+        self.clock = np.concatenate([self.clock, np.zeros(count)])
+        self.speed = np.concatenate([self.speed, np.broadcast_to(np.asarray(speeds, dtype=np.float64), (count,))])
+        self.position = np.concatenate([self.position, np.asarray(positions, dtype=np.int32).reshape(count, 2)])
+        return np.arange(first, first + count)
+
+    def spawn_random(self, count, area, seed=0):
+        # Random states, start frames, speeds between 0.5 and 2 and positions with the whole cell inside area
+        rng = np.random.default_rng(seed)
+        playable = np.flatnonzero(self.state_length > 0)
+        if not len(playable):
+            raise ValueError("No entity has a state with frames")
+        states = playable[rng.integers(len(playable), size=count)]
+        room = np.maximum(np.array(area, dtype=np.int32) - self.state_cell_size[states], 1)
+        positions = (rng.random((count, 2)) * room).astype(np.int32)
+        return self.add_instances(states, positions, rng.uniform(0.5, 2.0, count), rng.integers(1 << 16, size=count))
+
+    def set_states(self, instances, states):
+        # Switches instances to other states, they start from the first frame
+        states = np.asarray(states, dtype=np.int32)
+        if np.any(self.state_length[states] == 0):
+            raise ValueError("Instances can't play a state without frames")
+        self.state[instances] = states
+        self.frame[instances] = 0
+        self.clock[instances] = 0
+
+    def clear_instances(self):
+        self.state = self.state[:0]
+        self.frame = self.frame[:0]
+        self.clock = self.clock[:0]
+        self.speed = self.speed[:0]
+        self.position = self.position[:0]
+
+    def __len__(self):
+        return len(self.state)
+
+    def update(self, dt):
+        # Advances every instance's clock and steps as many frames as it passed, looping within its state
+        self.clock += dt * FRAME_RATE * self.speed
+        steps = np.floor(self.clock)
+        self.clock -= steps
+        self.frame = (self.frame + steps.astype(np.int32)) % self.state_length[self.state]
+
+    def draw(self, surface, cull=True):
+        # One blits call for all instances, cull=True leaves out instances entirely outside surface
+        frames = self.state_first[self.state] + self.frame
+        destinations = self.position + self.frame_offset[frames]
+        images = self.frame_image[frames]
+        if cull:
+            width, height = surface.get_size()
+            far_corner = self.position + self.state_cell_size[self.state]
+            visible = (far_corner[:, 0] > 0) & (far_corner[:, 1] > 0) & (self.position[:, 0] < width) & (self.position[:, 1] < height)
+            if not visible.all():
+                destinations = destinations[visible]
+                images = images[visible]
+        surface.blits(list(zip(map(self.images.__getitem__, images.tolist()), destinations.tolist())), doreturn=False)
+        return len(images)
+
+def load_entities(file_paths):
+    return [SpriteEntity.load_from_file(file_path) for file_path in file_paths]
+
+def run_playback(engine, screen, count, seconds=3.0, seed=0, profiler=None, show_overlay=False, text_cache=None):
+    # Plays count random instances as fast as the display allows for the given time, returns the frame count and
+    # the elapsed seconds. Phases are recorded on profiler, a FrameProfiler with a window of at least every frame.
+    engine.clear_instances()
+    engine.spawn_random(count, screen.get_size(), seed)
+    frames = 0
+    start = last = time.perf_counter()
+    while last - start < seconds:
+        if profiler is not None:
+            profiler.start_frame()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                return frames, last - start
+        now = time.perf_counter()
+        engine.update(now - last)
+        last = now
+        if profiler is not None:
+            profiler.lap("update")
+        screen.fill(BACKGROUND_COLOR)
+        engine.draw(screen)
+        if profiler is not None:
+            profiler.lap("draw")
+            if show_overlay:
+                profiler.render_overlay(screen, text_cache)
+                profiler.lap("overlay")
+        pygame.display.flip()
+        if profiler is not None:
+            profiler.lap("display_flip")
+            profiler.end_frame()
+        frames += 1
+    return frames, time.perf_counter() - start
+
+def benchmark_playback(engine, screen, counts=DEFAULT_COUNTS, seconds=3.0, seed=0, trace_path=None, show_overlay=False):
+    # Returns one result per instance count: sustained FPS plus p50/p95/p99/max ms of every phase
+    text_cache = TextCache() if show_overlay else None
+    results = []
+    trace_events = []
+    for count in counts:
+        profiler = FrameProfiler(window=1 << 20, trace_path=trace_path)
+        frames, elapsed = run_playback(engine, screen, count, seconds, seed, profiler, show_overlay, text_cache)
+        if profiler.trace_events is not None:
+            trace_events.extend(profiler.trace_events)
+        results.append({
+            "instances": count,
+            "frames": frames,
+            "fps": frames / elapsed if elapsed > 0 else 0.0,
+            "phases": {name: dict(zip(("p50_ms", "p95_ms", "p99_ms", "max_ms"), map(float, values))) for name, values in profiler.percentiles().items()}
+        })
+    if trace_path is not None:
+        with open(trace_path, 'w') as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+    return results
+
+def print_results(results, target_fps):
+    print(f"{'instances':>10}{'fps':>10}{'frame p50':>12}{'frame p95':>12}{'update p50':>12}{'draw p50':>12}")
+    for result in results:
+        phases = result["phases"]
+        print(f"{result['instances']:>10}{result['fps']:>10.1f}{phases['frame']['p50_ms']:>10.2f}ms{phases['frame']['p95_ms']:>10.2f}ms"
+              f"{phases['update']['p50_ms']:>10.2f}ms{phases['draw']['p50_ms']:>10.2f}ms")
+    sustained = [result["instances"] for result in results if result["fps"] >= target_fps]
+    if sustained:
+        print(f"Up to {max(sustained)} instances sustain {target_fps:g} FPS")
+    else:
+        print(f"No instance count sustains {target_fps:g} FPS")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many animated instances of saved sprite entities at once and report the sustained FPS.")
+    parser.add_argument("inputs", nargs="+", help="Saved entity folders or metadata.json files, globs are expanded")
+    parser.add_argument("--counts", type=int, nargs="+", default=list(DEFAULT_COUNTS), help="Instance counts to play one after another")
+    parser.add_argument("--seconds", type=float, default=3.0, help="How long every instance count plays")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the instances relative to the frames")
+    parser.add_argument("--screen-size", default="1920x1000", help="Size of the surface drawn to, WIDTHxHEIGHT")
+    parser.add_argument("--window", action="store_true", help="Open a window with the profiling overlay instead of drawing headless")
+    parser.add_argument("--target-fps", type=float, default=60, help="FPS an instance count has to reach to count as sustained")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace", default=None, help="Write a Chrome trace of every frame's phases to this file")
+    parser.add_argument("-o", "--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if not args.window:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    file_paths = collect_entity_files(args.inputs)
+    if not file_paths:
+        print("No saved entities found")
+        return 1
+    screen_size = tuple(int(value) for value in args.screen_size.lower().split("x"))
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode(screen_size)
+    pygame.display.set_caption("SpriteStash playback")
+    engine = PlaybackEngine(args.scale)
+    for sprite_entity in load_entities(file_paths):
+        engine.add_entity(sprite_entity)
+    print(f"{len(engine.entity_names)} entities, {len(engine.state_length)} states, {len(engine.frame_image)} frames, {len(engine.images)} unique images")
+    results = benchmark_playback(engine, screen, args.counts, args.seconds, args.seed, args.trace, args.window)
+    print_results(results, args.target_fps)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({"screen_size": list(screen_size), "scale": args.scale, "entities": engine.entity_names, "results": results}, file, indent=4)
+    pygame.quit()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
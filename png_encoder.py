@@ -0,0 +1,94 @@
+import os
+import threading
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+def filter_scanlines(pixels, paeth=True):
+    # Picks None, Sub, Up or Paeth per row by the smallest sum of signed filtered bytes, like libpng's heuristic.
+    # pixels is a (height, width, channels) uint8 array, returns the filter-prefixed scanlines as bytes.
+    # Paeth costs most of the time and rarely wins on pixel art, paeth=False leaves it out.
+    height, width, channels = pixels.shape
+    rows = pixels.reshape(height, width * channels)
+    padded = np.zeros((height + 1, (width + 1) * channels), dtype=np.uint8)
+    padded[1:, channels:] = rows
+    left = padded[1:, :-channels]
+    up = padded[:-1, channels:]
+    if not paeth:
+        candidates = np.stack([rows, rows - left, rows - up])
+        return select_filters(candidates, np.array([0, 1, 2], dtype=np.uint8))
+    up_left = padded[:-1, :-channels]
+    # With p = left + up - up_left, |p - left| = |up - up_left| and so on
+    distance_left = np.abs(up.astype(np.int16) - up_left)
+    distance_up = np.abs(left.astype(np.int16) - up_left)
+    distance_up_left = np.abs(left.astype(np.int16) + up - 2 * up_left.astype(np.int16))
+    paeth = np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                     np.where(distance_up <= distance_up_left, up, up_left))
+    candidates = np.stack([rows, rows - left, rows - up, rows - paeth])
+    return select_filters(candidates, np.array([0, 1, 2, 4], dtype=np.uint8))
+
+def select_filters(candidates, filter_types):
+    # candidates is (filters, height, row bytes), returns each row's smallest candidate prefixed with its filter type
+    _, height, row_bytes = candidates.shape
+    # Sum of the bytes read as signed magnitudes, abs(-128) wraps to -128 which is 128 again as uint8
+    scores = np.abs(candidates.view(np.int8)).view(np.uint8).sum(axis=2, dtype=np.uint32)
+    choice = scores.argmin(axis=0)
+    filtered = np.empty((height, row_bytes + 1), dtype=np.uint8)
+    filtered[:, 0] = filter_types[choice]
+    filtered[:, 1:] = candidates[choice, np.arange(height)]
+    return filtered.tobytes()
+
+def encode_png(width, height, rgba, compress_level=6, paeth=True):
+    # rgba holds the rows top to bottom, 4 bytes per pixel. zlib releases the GIL so this runs in parallel in threads.
+    pixels = np.frombuffer(rgba, dtype=np.uint8).reshape(height, width, 4)
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"".join([
+        PNG_SIGNATURE,
+        png_chunk(b"IHDR", header),
+        png_chunk(b"IDAT", zlib.compress(filter_scanlines(pixels, paeth), compress_level)),
+        png_chunk(b"IEND", b"")
+    ])
+
+def encode_apng(width, height, frames, delays_ms, loop_count=0, compress_level=6, paeth=True):
+    # frames are RGBA byte strings like encode_png takes, each one replaces the previous one whole.
+    # Runs of identical frames become one frame shown for their summed delay.
+    merged = []
+    for rgba, delay_ms in zip(frames, delays_ms):
+        if merged and merged[-1][0] == rgba:
+            merged[-1][1] += delay_ms
+        else:
+            merged.append([rgba, delay_ms])
+    chunks = [
+        PNG_SIGNATURE,
+        png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        png_chunk(b"acTL", struct.pack(">II", len(merged), loop_count))
+    ]
+    sequence = 0
+    for index, (rgba, delay_ms) in enumerate(merged):
+        # Delays are in milliseconds, dispose_op 1 clears the frame and blend_op 0 writes it without blending
+        chunks.append(png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, min(int(round(delay_ms)), 65535), 1000, 1, 0)))
+        sequence += 1
+        data = zlib.compress(filter_scanlines(np.frombuffer(rgba, dtype=np.uint8).reshape(height, width, 4), paeth), compress_level)
+        if index == 0:
+            chunks.append(png_chunk(b"IDAT", data))
+        else:
+            chunks.append(png_chunk(b"fdAT", struct.pack(">I", sequence) + data))
+            sequence += 1
+    chunks.append(png_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+def write_file_atomic(file_path, data):
+    # Readers never see a half written file, they get the old one or the new one
+    temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+    os.replace(temporary_path, file_path)
+
+def write_png(file_path, width, height, rgba, compress_level=6, paeth=True):
+    write_file_atomic(file_path, encode_png(width, height, rgba, compress_level, paeth))
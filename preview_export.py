@@ -0,0 +1,197 @@
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+from headless import init_headless_display
+from png_encoder import encode_apng, write_file_atomic, write_png
+from spritesheet_visualizer import SpriteEntity, copy_pixels
+from sprite_index import collect_entity_files
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_PREVIEW_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "previews")
+PREVIEW_FORMATS = ("apng", "gif")
+CONTACT_SHEET_BACKGROUND = (30, 30, 30, 255)
+CONTACT_SHEET_GAP = 2
+
+def frame_delay_ms(speed):
+    # Same timing as the viewer's frame timer, speed 1 shows 5 frames per second
+    return 1000 / (speed * 5)
+
+def entity_cell_size(sprite_entity):
+    if sprite_entity.sprite_width and sprite_entity.sprite_height:
+        return sprite_entity.sprite_width, sprite_entity.sprite_height
+    sizes = [sprite.get_image().get_size() for state in sprite_entity.states for sprite in state.sprites] or [(1, 1)]
+    return max(width for width, _ in sizes), max(height for _, height in sizes)
+
+def frame_key(sprite):
+    return sprite.content_hash or id(sprite.get_image()), tuple(sprite.trim_offset or ())
+
+def content_bounds(sprite_entity):
+    # Union of every frame's opaque pixels in cell coordinates, cropping to it keeps the frames aligned
+    bounds = None
+    seen = set()
+    for state in sprite_entity.states:
+        for sprite in state.sprites:
+            key = frame_key(sprite)
+            if key in seen:
+                continue
+            seen.add(key)
+            rect = sprite.get_image().get_bounding_rect().move(sprite.trim_offset or (0, 0))
+            if rect.width and rect.height:
+                bounds = rect if bounds is None else bounds.union(rect)
+    return bounds or pygame.Rect((0, 0), entity_cell_size(sprite_entity))
+
+class FrameRenderer:
+    # Draws frames onto their cell at a fixed scale, placing trimmed frames like the viewer does, and crops the
+    # cell to bounds. Frames with the same pixels and placement are drawn and converted to RGBA once.
+    def __init__(self, cell_size, scale, bounds=None):
+        self.cell_size = cell_size
+        self.cell_target = (max(1, round(cell_size[0] * scale)), max(1, round(cell_size[1] * scale)))
+        bounds = bounds or pygame.Rect((0, 0), cell_size)
+        scale_x = self.cell_target[0] / cell_size[0]
+        scale_y = self.cell_target[1] / cell_size[1]
+        self.origin = (int(bounds.x * scale_x), int(bounds.y * scale_y))
+        self.size = (
+            max(1, min(math.ceil(bounds.right * scale_x), self.cell_target[0]) - self.origin[0]),
+            max(1, min(math.ceil(bounds.bottom * scale_y), self.cell_target[1]) - self.origin[1])
+        )
+        self.surfaces = {}
+        self.rgba = {}
+
+    def render(self, sprite):
+        key = frame_key(sprite)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = pygame.Surface(self.size, pygame.SRCALPHA, 32)
+            image_size, (x, y) = sprite.placement(self.cell_size, self.cell_target)
+            if image_size[0] > 0 and image_size[1] > 0:
+                copy_pixels(surface, [(pygame.transform.scale(sprite.get_image(), image_size), (x - self.origin[0], y - self.origin[1]), None)])
+            self.surfaces[key] = surface
+        return surface
+
+    def render_rgba(self, sprite):
+        key = frame_key(sprite)
+        rgba = self.rgba.get(key)
+        if rgba is None:
+            rgba = self.rgba[key] = pygame.image.tobytes(self.render(sprite), "RGBA")
+        return rgba
+
+def write_gif(file_path, size, frames, delay_ms, loop_count=0):
+    images = [Image.frombytes("RGBA", size, rgba) for rgba in frames]
+    images[0].save(file_path, save_all=True, append_images=images[1:], duration=int(round(delay_ms)), loop=loop_count, disposal=2)
+
+def compose_contact_sheet(sprite_entity, thumbnail_size, bounds=None):
+    # One row per state and one column per frame, every frame's bounds fitted into a thumbnail_size square
+    bounds = bounds or content_bounds(sprite_entity)
+    renderer = FrameRenderer(entity_cell_size(sprite_entity), thumbnail_size / max(bounds.width, bounds.height), bounds)
+    columns = max((len(state.sprites) for state in sprite_entity.states), default=0)
+    pitch_x = renderer.size[0] + CONTACT_SHEET_GAP
+    pitch_y = renderer.size[1] + CONTACT_SHEET_GAP
+    contact_sheet = pygame.Surface((max(1, columns * pitch_x + CONTACT_SHEET_GAP), len(sprite_entity.states) * pitch_y + CONTACT_SHEET_GAP), pygame.SRCALPHA, 32)
+    contact_sheet.fill(CONTACT_SHEET_BACKGROUND)
+    contact_sheet.blits([
+        (renderer.render(sprite), (CONTACT_SHEET_GAP + sprite_index * pitch_x, CONTACT_SHEET_GAP + state_index * pitch_y))
+        for state_index, state in enumerate(sprite_entity.states)
+        for sprite_index, sprite in enumerate(state.sprites)
+    ], doreturn=False)
+    return contact_sheet
+
+def export_entity_previews(sprite_entity, folder_path, scale=1.0, speed=1, formats=("apng",), contact_sheet=True, thumbnail_size=64, loop_count=0, crop=True):
+    # Writes state_<n>.png (APNG) and/or state_<n>.gif for every state plus contact_sheet.png, returns the written paths.
+    # Works on any loaded SpriteEntity or FrameStore, nothing is drawn through the display. With crop=True the
+    # animations leave out the cell area no frame of the entity ever draws to.
+    for preview_format in formats:
+        if preview_format not in PREVIEW_FORMATS:
+            raise ValueError(f"Unknown preview format '{preview_format}', expected one of {PREVIEW_FORMATS}")
+    if "gif" in formats and Image is None:
+        raise ImportError("GIF previews need the Pillow package")
+    os.makedirs(folder_path, exist_ok=True)
+    bounds = content_bounds(sprite_entity)
+    renderer = FrameRenderer(entity_cell_size(sprite_entity), scale, bounds if crop else None)
+    delay_ms = frame_delay_ms(speed)
+    written = []
+    for state_index, state in enumerate(sprite_entity.states):
+        if not len(state.sprites):
+            continue
+        frames = [renderer.render_rgba(sprite) for sprite in state.sprites]
+        if "apng" in formats:
+            file_path = os.path.join(folder_path, f"state_{state_index}.png")
+            # Previews are rewritten whenever the library changes, encoding speed matters more than the last bytes
+            write_file_atomic(file_path, encode_apng(*renderer.size, frames, [delay_ms] * len(frames), loop_count, paeth=False))
+            written.append(file_path)
+        if "gif" in formats:
+            file_path = os.path.join(folder_path, f"state_{state_index}.gif")
+            write_gif(file_path, renderer.size, frames, delay_ms, loop_count)
+            written.append(file_path)
+    if contact_sheet:
+        file_path = os.path.join(folder_path, "contact_sheet.png")
+        surface = compose_contact_sheet(sprite_entity, thumbnail_size, bounds)
+        write_png(file_path, surface.get_width(), surface.get_height(), pygame.image.tobytes(surface, "RGBA"), paeth=False)
+        written.append(file_path)
+    return written
+
+def export_entity_file(file_path, preview_folder, options):
+    # Frames shared by several states or files of the entity are decoded once by load_from_file
+    sprite_entity = SpriteEntity.load_from_file(file_path)
+    written = export_entity_previews(sprite_entity, os.path.join(preview_folder, sprite_entity.name), **options)
+    return sum(len(state.sprites) for state in sprite_entity.states), len(written)
+
+def export_library(file_paths, preview_folder=DEFAULT_PREVIEW_FOLDER, workers=None, **options):
+    # Exports the saved entities' metadata.json files in a process pool, returns ((frames, files), failures)
+    failures = {}
+    frame_count = file_count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_headless_display) as executor:
+        futures = {executor.submit(export_entity_file, file_path, preview_folder, options): file_path for file_path in file_paths}
+        for future in as_completed(futures):
+            try:
+                frames, files = future.result()
+                frame_count += frames
+                file_count += files
+            except Exception as e:
+                failures[futures[future]] = f"{type(e).__name__}: {e}"
+    return (frame_count, file_count), failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write animated previews and contact sheets of saved sprite entities without a display.")
+    parser.add_argument("inputs", nargs="+", help="Saved entity folders or metadata.json files, globs are expanded")
+    parser.add_argument("-o", "--output", default=DEFAULT_PREVIEW_FOLDER, help="Folder the previews are written to, one subfolder per entity")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the animated previews relative to the frames")
+    parser.add_argument("--speed", type=float, default=1, help="Playback speed, 1 matches the viewer's default of 5 frames per second")
+    parser.add_argument("--format", choices=PREVIEW_FORMATS, nargs="+", default=["apng"], help="Animation formats, gif needs Pillow")
+    parser.add_argument("--thumbnail-size", type=int, default=64, help="Longest side of a frame in the contact sheet")
+    parser.add_argument("--no-contact-sheet", action="store_true")
+    parser.add_argument("--no-crop", action="store_true", help="Keep the whole cell in the animations instead of the area the frames draw to")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (defaults to the CPU count)")
+    args = parser.parse_args(argv)
+
+    if "gif" in args.format and Image is None:
+        print("GIF previews need the Pillow package")
+        return 1
+    file_paths = collect_entity_files(args.inputs)
+    if not file_paths:
+        print("No saved entities found")
+        return 1
+    options = {
+        "scale": args.scale, "speed": args.speed, "formats": tuple(args.format),
+        "contact_sheet": not args.no_contact_sheet, "thumbnail_size": args.thumbnail_size, "crop": not args.no_crop
+    }
+    start = time.perf_counter()
+    (frame_count, file_count), failures = export_library(file_paths, args.output, args.workers, **options)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {file_count} previews of {len(file_paths) - len(failures)}/{len(file_paths)} entities ({frame_count} frames) in {elapsed:.2f}s")
+    for file_path, error in sorted(failures.items()):
+        print(f"FAILED {file_path}: {error}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+CATALOG_FILE_NAME = "catalog.sqlite"
+TEXT_COLUMNS = ("name", "description", "source", "state_names")
+TEXT_OPERATORS = ("AND", "OR", "NOT", "(", ")")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    name TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    description TEXT NOT NULL,
+    source TEXT NOT NULL,
+    sprite_width INTEGER NOT NULL,
+    sprite_height INTEGER NOT NULL,
+    state_count INTEGER NOT NULL,
+    frame_count INTEGER NOT NULL,
+    unique_frame_count INTEGER NOT NULL,
+    atlas_url TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS states (
+    entity TEXT NOT NULL REFERENCES entities(name) ON DELETE CASCADE,
+    state_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    frame_count INTEGER NOT NULL,
+    PRIMARY KEY (entity, state_index)
+);
+CREATE INDEX IF NOT EXISTS entities_frame_size ON entities (sprite_width, sprite_height);
+CREATE INDEX IF NOT EXISTS entities_frame_count ON entities (frame_count);
+CREATE INDEX IF NOT EXISTS states_name ON states (name);
+CREATE VIRTUAL TABLE IF NOT EXISTS entities_text USING fts5 (name, description, source, state_names);
+"""
+
+def text_query(text):
+    # Bare words go to FTS5 quoted, so names like demon-slime match as a phrase instead of failing to parse.
+    # AND, OR, NOT, parentheses, column filters (name:slime) and a trailing * keep their meaning.
+    terms = []
+    for token in re.findall(r"[()]|[^\s()]+", text):
+        if token in TEXT_OPERATORS:
+            terms.append(token)
+            continue
+        column, separator, rest = token.partition(":")
+        prefix = ""
+        if separator and column in TEXT_COLUMNS and rest:
+            prefix, token = column + ":", rest
+        star = "*" if token.endswith("*") and token.rstrip("*") else ""
+        token = token.rstrip("*") if star else token
+        terms.append(prefix + '"' + token.replace('"', '""') + '"' + star)
+    return " ".join(terms)
+
+class SpriteCatalog:
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        # Batch ingest workers save concurrently, WAL lets readers continue while one of them writes
+        self.connection = sqlite3.connect(catalog_path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def upsert(self, sprite_entity, folder_path):
+        sprites = [sprite for state in sprite_entity.states for sprite in state.sprites]
+        unique_frame_count = len({sprite.content_hash or id(sprite) for sprite in sprites})
+        state_names = " ".join(state.name for state in sprite_entity.states)
+        with self.connection:
+            self.delete(sprite_entity.name)
+            cursor = self.connection.execute(
+                "INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (sprite_entity.name, os.path.abspath(folder_path), sprite_entity.description, sprite_entity.source,
+                 sprite_entity.sprite_width, sprite_entity.sprite_height, len(sprite_entity.states), len(sprites),
+                 unique_frame_count, sprite_entity.atlas_url, time.time())
+            )
+            self.connection.executemany(
+                "INSERT INTO states VALUES (?, ?, ?, ?, ?)",
+                [(sprite_entity.name, state_index, state.name, state.description, len(state.sprites))
+                 for state_index, state in enumerate(sprite_entity.states)]
+            )
+            # The text row shares the entity's rowid so deletes don't scan the full-text table
+            self.connection.execute(
+                "INSERT INTO entities_text (rowid, name, description, source, state_names) VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, sprite_entity.name, sprite_entity.description, sprite_entity.source, state_names)
+            )
+
+    def delete(self, name):
+        row = self.connection.execute("SELECT rowid FROM entities WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM entities_text WHERE rowid = ?", (row[0],))
+            self.connection.execute("DELETE FROM entities WHERE rowid = ?", (row[0],))
+
+    def remove(self, name):
+        with self.connection:
+            self.delete(name)
+
+    def get(self, name):
+        row = self.connection.execute("SELECT * FROM entities WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def states(self, name):
+        rows = self.connection.execute("SELECT * FROM states WHERE entity = ? ORDER BY state_index", (name,))
+        return [dict(row) for row in rows]
+
+    def query(self, text=None, sprite_width=None, sprite_height=None, min_frames=None, max_frames=None, state=None, limit=None):
+        # text is a full-text query over name, description, source and state names, the other filters are exact
+        conditions = []
+        parameters = []
+        if text:
+            conditions.append("rowid IN (SELECT rowid FROM entities_text WHERE entities_text MATCH ?)")
+            parameters.append(text_query(text))
+        for column, value in (("sprite_width", sprite_width), ("sprite_height", sprite_height)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if min_frames is not None:
+            conditions.append("frame_count >= ?")
+            parameters.append(min_frames)
+        if max_frames is not None:
+            conditions.append("frame_count <= ?")
+            parameters.append(max_frames)
+        if state is not None:
+            conditions.append("name IN (SELECT entity FROM states WHERE name = ?)")
+            parameters.append(state)
+        sql = "SELECT * FROM entities"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY name"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+    def rebuild(self, output_folder):
+        # Indexes entities saved before the catalog existed, reads each metadata.json once
+        from spritesheet_visualizer import SpriteEntity
+        names = []
+        for file_path in sorted(glob.glob(os.path.join(output_folder, "*", "metadata.json"))):
+            with open(file_path, 'r') as file:
+                sprite_entity = SpriteEntity(**json.load(file))
+            self.upsert(sprite_entity, os.path.dirname(file_path))
+            names.append(sprite_entity.name)
+        with self.connection:
+            for row in self.connection.execute("SELECT name FROM entities").fetchall():
+                if row["name"] not in names:
+                    self.delete(row["name"])
+        return len(names)
+
+def main(argv=None):
+    from spritesheet_visualizer import DEFAULT_OUTPUT_FOLDER
+    parser = argparse.ArgumentParser(description="List and search the catalog of saved sprite entities.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FOLDER, help="Output folder holding the entities and the catalog")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="Re-index every metadata.json in the output folder")
+    search_parser = commands.add_parser("search", help="List entities matching the filters")
+    search_parser.add_argument("text", nargs="?", default=None, help="Full-text query, e.g. 'slime OR dino'")
+    search_parser.add_argument("--size", default=None, help="Frame size, e.g. 288x128")
+    search_parser.add_argument("--min-frames", type=int, default=None)
+    search_parser.add_argument("--max-frames", type=int, default=None)
+    search_parser.add_argument("--state", default=None, help="Only entities with a state of this name")
+    search_parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with SpriteCatalog(os.path.join(args.output, CATALOG_FILE_NAME)) as catalog:
+        if args.command == "rebuild":
+            print(f"Catalogued {catalog.rebuild(args.output)} entities")
+            return 0
+        sprite_width, sprite_height = map(int, args.size.lower().split("x")) if args.size else (None, None)
+        start = time.perf_counter()
+        try:
+            entities = catalog.query(args.text, sprite_width, sprite_height, args.min_frames, args.max_frames, args.state, args.limit)
+        except sqlite3.OperationalError as e:
+            # Operators left dangling, e.g. 'slime AND', still don't parse
+            search_parser.error(f"invalid search '{args.text}' ({e}), combine words with AND, OR and NOT, e.g. 'slime OR dino*'")
+        elapsed = time.perf_counter() - start
+        for entity in entities:
+            print(f"{entity['name']}  {entity['sprite_width']}x{entity['sprite_height']}  {entity['state_count']} states, "
+                  f"{entity['frame_count']} frames ({entity['unique_frame_count']} unique)  {entity['folder']}")
+        print(f"{len(entities)} entities in {elapsed * 1000:.1f}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
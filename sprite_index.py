@@ -0,0 +1,314 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pygame
+from headless import init_headless_display
+from spritesheet_visualizer import SpriteEntity
+
+try:
+    import lancedb
+except ImportError:
+    lancedb = None
+
+DEFAULT_INDEX_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sprite_index")
+THUMBNAIL_SIZE = 8
+HISTOGRAM_LEVELS = 4
+EMBEDDING_DIMS = THUMBNAIL_SIZE * THUMBNAIL_SIZE * 4 + HISTOGRAM_LEVELS ** 3
+INDEX_KINDS = ("frame", "entity")
+BRUTE_FORCE_ROWS = 20000  # Below this many rows an exact scan is as fast as probing the IVF lists
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def frame_embedding(image):
+    # Layout of the cropped content at 8x8 (premultiplied RGBA) plus an alpha weighted color histogram
+    embedding = np.zeros(EMBEDDING_DIMS, dtype=np.float32)
+    bounds = image.get_bounding_rect()
+    if bounds.width == 0 or bounds.height == 0:
+        return embedding
+    content = image.subsurface(bounds)
+    thumbnail = pygame.transform.smoothscale(content, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    alpha = pygame.surfarray.array_alpha(thumbnail).astype(np.float32)[..., None] / 255
+    rgb = pygame.surfarray.array3d(thumbnail).astype(np.float32) / 255
+    layout = np.concatenate([rgb * alpha, alpha], axis=2).ravel()
+
+    levels = pygame.surfarray.array3d(content).astype(np.int32) * HISTOGRAM_LEVELS // 256
+    bins = (levels[..., 0] * HISTOGRAM_LEVELS + levels[..., 1]) * HISTOGRAM_LEVELS + levels[..., 2]
+    histogram = np.bincount(bins.ravel(), weights=pygame.surfarray.array_alpha(content).ravel(), minlength=HISTOGRAM_LEVELS ** 3)
+
+    embedding[:layout.size] = normalize(layout)
+    embedding[layout.size:] = normalize(histogram.astype(np.float32))
+    return normalize(embedding)
+
+def entity_embeddings(sprite_entity):
+    # Returns {kind: (rows, vectors)}, one frame row per unique frame and one row for the entity
+    rows = []
+    vectors = []
+    seen = set()
+    for state_index, state in enumerate(sprite_entity.states):
+        for sprite_index, sprite in enumerate(state.sprites):
+            key = sprite.content_hash or (state_index, sprite_index)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({"entity": sprite_entity.name, "state": state_index, "frame": sprite_index, "content_hash": sprite.content_hash})
+            vectors.append(frame_embedding(sprite.get_image()))
+    frame_vectors = np.array(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIMS)
+    entity_vector = normalize(frame_vectors.sum(axis=0, keepdims=True)) if len(frame_vectors) else np.zeros((1, EMBEDDING_DIMS), dtype=np.float32)
+    return {
+        "frame": (rows, frame_vectors),
+        "entity": ([{"entity": sprite_entity.name, "state": -1, "frame": -1, "content_hash": ""}], entity_vector)
+    }
+
+def train_centroids(vectors, list_count, iterations=10, seed=0):
+    # Spherical k-means on a sample, enough to partition the vectors for IVF probing
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), list_count * 64), replace=False))]
+    centroids = sample[rng.choice(len(sample), list_count, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+def assign_lists(vectors, centroids, chunk_size=65536):
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk_size)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+class VectorTable:
+    # Vectors of indexed rows are stored grouped by IVF list, rows added after build_index are scanned exactly
+    def __init__(self, path):
+        self.path = path
+        self.rows = []
+        self.vectors = np.zeros((0, EMBEDDING_DIMS), dtype=np.float32)
+        self.centroids = None
+        self.list_offsets = None
+        self.indexed_count = 0
+        if os.path.exists(path + ".json"):
+            with open(path + ".json", 'r') as file:
+                self.rows = json.load(file)
+            self.vectors = np.load(path + ".vectors.npy", mmap_mode="r")
+            if os.path.exists(path + ".ivf.npz"):
+                ivf = np.load(path + ".ivf.npz")
+                self.centroids = ivf["centroids"]
+                self.list_offsets = ivf["list_offsets"]
+                self.indexed_count = int(self.list_offsets[-1])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def remove_entities(self, entity_names):
+        keep = [index for index, row in enumerate(self.rows) if row["entity"] not in entity_names]
+        if len(keep) == len(self.rows):
+            return
+        keep = np.array(keep, dtype=np.int64)
+        if self.centroids is not None:
+            # Removing rows shifts the IVF lists, keep them valid by recounting each list's survivors
+            indexed = keep[keep < self.indexed_count]
+            lists = np.searchsorted(self.list_offsets, indexed, side="right") - 1
+            self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))])
+            self.indexed_count = len(indexed)
+        self.rows = [self.rows[index] for index in keep]
+        self.vectors = np.asarray(self.vectors)[keep]
+
+    def add(self, rows, vectors):
+        self.rows.extend(rows)
+        self.vectors = np.concatenate([self.vectors, vectors.astype(np.float32)])
+
+    def build_index(self, list_count=None):
+        if len(self.rows) < BRUTE_FORCE_ROWS:
+            self.centroids = None
+            self.list_offsets = None
+            self.indexed_count = 0
+            return
+        vectors = np.asarray(self.vectors)
+        list_count = list_count or int(math.sqrt(len(vectors)))
+        self.centroids = train_centroids(vectors, list_count)
+        assignment = assign_lists(vectors, self.centroids)
+        order = np.argsort(assignment, kind="stable")
+        self.vectors = vectors[order]
+        self.rows = [self.rows[index] for index in order]
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=list_count))])
+        self.indexed_count = len(self.rows)
+
+    def search(self, query, k=10, probe_count=16):
+        if not self.rows:
+            return []
+        if self.centroids is None:
+            ranges = [(0, len(self.rows))]
+        else:
+            # Probed lists are contiguous, score them as slices instead of gathering the candidate vectors
+            probe_count = min(probe_count, len(self.centroids))
+            lists = np.argpartition(-(self.centroids @ query), probe_count - 1)[:probe_count]
+            ranges = [(self.list_offsets[index], self.list_offsets[index + 1]) for index in lists]
+            ranges.append((self.indexed_count, len(self.rows)))
+        ranges = [(start, end) for start, end in ranges if end > start]
+        if not ranges:
+            return []
+        candidates = np.concatenate([np.arange(start, end) for start, end in ranges])
+        scores = np.concatenate([self.vectors[start:end] @ query for start, end in ranges])
+        k = min(k, len(candidates))
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        best = best[np.argsort(-scores[best])]
+        return [dict(self.rows[candidates[index]], distance=float(1 - scores[index])) for index in best]
+
+    def save(self):
+        # The vectors may be memory mapped from the file being replaced, write aside and swap it in
+        with open(self.path + ".json.tmp", 'w') as file:
+            json.dump(self.rows, file)
+        with open(self.path + ".vectors.npy.tmp", 'wb') as file:
+            np.save(file, np.asarray(self.vectors))
+        os.replace(self.path + ".vectors.npy.tmp", self.path + ".vectors.npy")
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+        if self.centroids is not None:
+            np.savez(self.path + ".ivf.npz", centroids=self.centroids, list_offsets=self.list_offsets)
+        elif os.path.exists(self.path + ".ivf.npz"):
+            os.remove(self.path + ".ivf.npz")
+
+class LanceVectorTable:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.table = database.open_table(name) if name in database.table_names() else None
+
+    def __len__(self):
+        return self.table.count_rows() if self.table is not None else 0
+
+    def remove_entities(self, entity_names):
+        if self.table is not None and entity_names:
+            names = ", ".join("'" + name.replace("'", "''") + "'" for name in entity_names)
+            self.table.delete(f"entity IN ({names})")
+
+    def add(self, rows, vectors):
+        data = [dict(row, vector=vector.tolist()) for row, vector in zip(rows, vectors)]
+        if not data:
+            return
+        if self.table is None:
+            self.table = self.database.create_table(self.name, data=data)
+        else:
+            self.table.add(data)
+
+    def build_index(self, list_count=None):
+        if len(self) >= BRUTE_FORCE_ROWS:
+            self.table.create_index(metric="cosine", num_partitions=list_count or int(math.sqrt(len(self))), replace=True)
+
+    def search(self, query, k=10, probe_count=16):
+        if self.table is None:
+            return []
+        hits = self.table.search(query).metric("cosine").nprobes(probe_count).limit(k).to_list()
+        return [
+            {"entity": hit["entity"], "state": hit["state"], "frame": hit["frame"], "content_hash": hit["content_hash"], "distance": float(hit["_distance"])}
+            for hit in hits
+        ]
+
+    def save(self):
+        pass
+
+class SpriteIndex:
+    def __init__(self, folder_path=DEFAULT_INDEX_FOLDER, backend=None):
+        # Uses LanceDB when it is installed, otherwise a numpy IVF index stored next to the rows
+        backend = backend or ("lancedb" if lancedb is not None else "numpy")
+        os.makedirs(folder_path, exist_ok=True)
+        self.folder_path = folder_path
+        self.backend = backend
+        if backend == "lancedb":
+            if lancedb is None:
+                raise ImportError("The lancedb backend needs the lancedb package")
+            database = lancedb.connect(folder_path)
+            self.tables = {kind: LanceVectorTable(database, kind) for kind in INDEX_KINDS}
+        elif backend == "numpy":
+            self.tables = {kind: VectorTable(os.path.join(folder_path, kind)) for kind in INDEX_KINDS}
+        else:
+            raise ValueError(f"Unknown index backend '{backend}', expected 'lancedb' or 'numpy'")
+
+    def add_embeddings(self, embeddings):
+        # Takes a list of entity_embeddings() results, re-adding an entity replaces its previous rows
+        entity_names = {rows[0]["entity"] for rows, _ in (embedding["entity"] for embedding in embeddings)}
+        for kind, table in self.tables.items():
+            table.remove_entities(entity_names)
+            rows = [row for embedding in embeddings for row in embedding[kind][0]]
+            if rows:
+                table.add(rows, np.concatenate([embedding[kind][1] for embedding in embeddings]))
+
+    def add_entities(self, sprite_entities):
+        self.add_embeddings([entity_embeddings(sprite_entity) for sprite_entity in sprite_entities])
+
+    def remove_entities(self, entity_names):
+        for table in self.tables.values():
+            table.remove_entities(set(entity_names))
+
+    def build_index(self):
+        for table in self.tables.values():
+            table.build_index()
+
+    def save(self):
+        for table in self.tables.values():
+            table.save()
+
+    def search(self, query, k=10, kind="frame", probe_count=16):
+        # query is a pygame Surface or an embedding vector, hits are sorted by cosine distance
+        if isinstance(query, pygame.Surface):
+            query = frame_embedding(query)
+        return self.tables[kind].search(np.asarray(query, dtype=np.float32), k, probe_count)
+
+    def similar_to(self, sprite_entity, state_index=0, sprite_index=0, k=10):
+        return self.search(sprite_entity.states[state_index].sprites[sprite_index].get_image(), k)
+
+def collect_entity_files(inputs):
+    file_paths = []
+    for pattern in inputs:
+        for path in sorted(glob.glob(pattern)):
+            if os.path.isdir(path):
+                path = os.path.join(path, "metadata.json")
+            # Globs over an output folder also match its catalog and ingest manifest
+            if os.path.basename(path) == "metadata.json" and os.path.exists(path):
+                file_paths.append(path)
+    return list(dict.fromkeys(file_paths))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index saved sprite entities by appearance and find sprites that look alike.")
+    parser.add_argument("--index", default=DEFAULT_INDEX_FOLDER, help="Folder the index is stored in")
+    parser.add_argument("--backend", choices=("lancedb", "numpy"), default=None, help="Vector store (LanceDB when installed)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="Add saved sprite entities (folders or metadata.json files)")
+    add_parser.add_argument("inputs", nargs="+")
+    query_parser = commands.add_parser("query", help="Find the frames or entities closest to an image")
+    query_parser.add_argument("image")
+    query_parser.add_argument("-k", type=int, default=10)
+    query_parser.add_argument("--entities", action="store_true", help="Match whole entities instead of frames")
+    args = parser.parse_args(argv)
+
+    init_headless_display()
+    sprite_index = SpriteIndex(args.index, args.backend)
+
+    if args.command == "add":
+        start = time.perf_counter()
+        sprite_entities = [SpriteEntity.load_from_file(file_path, lazy=True) for file_path in collect_entity_files(args.inputs)]
+        sprite_index.add_entities(sprite_entities)
+        sprite_index.build_index()
+        sprite_index.save()
+        print(f"Indexed {len(sprite_entities)} entities, {len(sprite_index.tables['frame'])} frames in {time.perf_counter() - start:.2f}s")
+    else:
+        image = pygame.image.load(args.image).convert_alpha()
+        start = time.perf_counter()
+        hits = sprite_index.search(image, args.k, "entity" if args.entities else "frame")
+        elapsed = time.perf_counter() - start
+        for hit in hits:
+            print(f"{hit['distance']:.4f}  {hit['entity']}  state {hit['state']} frame {hit['frame']}")
+        print(f"{len(hits)} hits in {elapsed * 1000:.1f}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
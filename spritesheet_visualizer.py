@@ -1,26 +1,414 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import groupby
 import os
+import hashlib
 import json
+import math
+import sqlite3
+import threading
+import time
+import numpy as np
 import pygame
-import os
+from frame_profiler import FrameProfiler
+from png_encoder import write_file_atomic, write_png
+from sprite_catalog import CATALOG_FILE_NAME, SpriteCatalog
+
+DEFAULT_OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "out_sprites")
+ATLAS_FORMATS = ("png", "rgba")
+SPRITESHEET_LOADED = pygame.event.custom_type()
+SPRITE_ENTITY_SAVE_PROGRESS = pygame.event.custom_type()
+SAVE_WORKERS = min(8, os.cpu_count() or 1)
+RESLICE_DELAY = 0.4  # Seconds the sprite size has to stay unchanged before the sheet is re-sliced
+
+class SurfaceCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.surfaces = OrderedDict()
+
+    def get_or_create(self, key, create):
+        surface = self.lookup(key)
+        if surface is None:
+            surface = create()
+            self.insert(key, surface)
+        return surface
+
+    def lookup(self, key):
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+        return surface
+
+    def insert(self, key, surface):
+        if key in self.surfaces:
+            self.used_bytes -= self.surface_bytes(self.surfaces.pop(key))
+        self.surfaces[key] = surface
+        self.used_bytes += self.surface_bytes(surface)
+        while self.max_bytes is not None and self.used_bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.used_bytes -= self.surface_bytes(evicted)
+
+    def discard(self, key):
+        surface = self.surfaces.pop(key, None)
+        if surface is not None:
+            self.used_bytes -= self.surface_bytes(surface)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.used_bytes = 0
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+class DecodedImageCache(SurfaceCache):
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        super().__init__(max_bytes)
+
+    def get(self, image_url):
+        return self.get_or_create(image_url, lambda: pygame.image.load(image_url).convert_alpha())
+
+# Shared by every lazily loaded sprite, set max_bytes to None to keep everything decoded
+decoded_image_cache = DecodedImageCache()
 
 class Sprite(BaseModel):
     name: str = ""
     image_url: str
     description: str = ""
+    rect: Optional[List[int]] = None
+    content_hash: str = ""
+    trim_offset: Optional[List[int]] = None  # Position of a trimmed image within its cell, None when the image is the full cell
     image: Optional[pygame.Surface] = None
     class Config:
         arbitrary_types_allowed = True
-    def load_image(self):
+    def load_image(self, images=None):
+        # Deduplicated frames share an image_url, pass the same images dict to decode each file once
         if self.image_url:
+            if images is not None and self.image_url in images:
+                self.image = images[self.image_url]
+                return
             self.image = pygame.image.load(self.image_url).convert_alpha()
+            if images is not None:
+                images[self.image_url] = self.image
+
+    def get_image(self):
+        # Lazily loaded sprites hold no surface of their own and decode through the shared cache
+        if self.image is None and self.image_url:
+            return decoded_image_cache.get(self.image_url)
+        return self.image
+
+    def placement(self, cell_size, target_size):
+        # Returns the size and offset to draw the image at when its cell is drawn at target_size.
+        # Edges are scaled like the full cell would be so trimmed animations don't jitter.
+        if self.trim_offset is None:
+            return target_size, (0, 0)
+        image_width, image_height = self.get_image().get_size()
+        scale_x = target_size[0] / cell_size[0]
+        scale_y = target_size[1] / cell_size[1]
+        x, y = self.trim_offset
+        left, top = int(x * scale_x), int(y * scale_y)
+        return (int((x + image_width) * scale_x) - left, int((y + image_height) * scale_y) - top), (left, top)
 
 class StateSequence(BaseModel):
     name: str
     sprites: List[Sprite]
     description: str = ""
 
+    def load_images(self, images=None):
+        if images is None:
+            images = {}
+        for sprite in self.sprites:
+            if sprite.image is None:
+                sprite.load_image(images)
+
+class SpriteGrid(BaseModel):
+    sprite_width: int
+    sprite_height: int
+    offset_x: int = 0
+    offset_y: int = 0
+    padding_x: int = 0
+    padding_y: int = 0
+
+def grid_cell_count(length, sprite_size, offset, padding):
+    if sprite_size <= 0 or length - offset < sprite_size:
+        return 0
+    return (length - offset - sprite_size) // (sprite_size + padding) + 1
+
+def find_occupied_cells(spritesheet, sprite_width, sprite_height, offset_x=0, offset_y=0, padding_x=0, padding_y=0):
+    # Returns the (row, column) of every non-empty cell in row-major order and the
+    # tight bounding rect (x, y, w, h) of its opaque pixels in sheet coordinates.
+    if sprite_width <= 0 or sprite_height <= 0:
+        raise ValueError(f"Invalid sprite size {sprite_width}x{sprite_height}")
+    columns = grid_cell_count(spritesheet.get_width(), sprite_width, offset_x, padding_x)
+    rows = grid_cell_count(spritesheet.get_height(), sprite_height, offset_y, padding_y)
+    if columns == 0 or rows == 0:
+        return np.empty((0, 2), dtype=np.intp), np.empty((0, 4), dtype=np.intp)
+    pitch_x = sprite_width + padding_x
+    pitch_y = sprite_height + padding_y
+    if spritesheet.get_flags() & pygame.SRCALPHA:
+        alpha = pygame.surfarray.pixels_alpha(spritesheet)
+    else:
+        alpha = pygame.surfarray.array_alpha(spritesheet)
+    # surfarray is indexed [x, y]; split both axes into (cell, pixel within cell)
+    region = alpha[offset_x:offset_x + columns * pitch_x, offset_y:offset_y + rows * pitch_y] > 0
+    del alpha
+    if region.shape != (columns * pitch_x, rows * pitch_y):
+        # The padding after the last cell may run past the sheet edge
+        opaque = np.zeros((columns * pitch_x, rows * pitch_y), dtype=bool)
+        opaque[:region.shape[0], :region.shape[1]] = region
+    else:
+        opaque = region
+    opaque = opaque.reshape(columns, pitch_x, rows, pitch_y)[:, :sprite_width, :, :sprite_height]
+    opaque_columns = opaque.any(axis=3)
+    opaque_rows = opaque.any(axis=1)
+    occupied = opaque_columns.any(axis=1)
+    cell_rows, cell_columns = np.nonzero(occupied.T)
+    xs = opaque_columns[cell_columns, :, cell_rows]
+    ys = opaque_rows[cell_columns, cell_rows, :]
+    left = xs.argmax(axis=1)
+    top = ys.argmax(axis=1)
+    right = sprite_width - xs[:, ::-1].argmax(axis=1)
+    bottom = sprite_height - ys[:, ::-1].argmax(axis=1)
+    cells = np.stack([cell_rows, cell_columns], axis=1)
+    bounds = np.stack([
+        offset_x + cell_columns * pitch_x + left,
+        offset_y + cell_rows * pitch_y + top,
+        right - left,
+        bottom - top
+    ], axis=1)
+    return cells, bounds
+
+def profile_periodicity(profile):
+    # Normalized autocorrelation of the mean-centered profile for every lag, via FFT
+    length = len(profile)
+    centered = profile - profile.mean()
+    size = 1 << (2 * length - 1).bit_length()
+    spectrum = np.fft.rfft(centered, size)
+    correlation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:length]
+    energy = np.concatenate([[0.0], np.cumsum(centered * centered)])
+    lags = np.arange(length)
+    overlap_energy = energy[length - lags] * (energy[length] - energy[lags])
+    return correlation / np.sqrt(np.maximum(overlap_energy, 1e-12))
+
+def detect_grid_axis(profile, straddle=None, min_size=8):
+    # Returns (sprite_size, offset, padding) along one axis of an alpha projection profile. straddle[i] counts the
+    # lines across the axis where pixels i - 1 and i are both opaque, content never straddles a real grid line.
+    length = len(profile)
+    profile = profile.astype(np.float64)
+    if length < 2 * min_size or not profile.any():
+        return length, 0, 0
+    periodicity = profile_periodicity(profile)
+    crossing = np.zeros(length + 1)
+    if straddle is None:
+        # Without straddle counts a grid line is crossed when content sits anywhere on both sides of it
+        crossing[1:length] = np.minimum(profile[:-1], profile[1:])
+    else:
+        crossing[1:length] = straddle
+    # Two cells along the axis put the pitch at exactly half the length. That lag is scored too, and only has to beat
+    # the lag before it since the overlap past it is too short to compare against.
+    lags = np.arange(min_size, length // 2 + 1)
+    scores = periodicity[lags]
+    after = np.append(periodicity[lags[:-1] + 1], -np.inf)
+    is_peak = (scores >= periodicity[lags - 1]) & (scores >= after) & (scores > 0.3)
+    # Autocorrelation peaks of large cells are broad and can sit a few pixels off the pitch, and sparse rows can
+    # make a multiple of the pitch peak instead of the pitch. The grid line crossings below sort those out.
+    peaks = lags[is_peak].tolist()
+    seeds = set(peaks).union(lag // divisor for lag in peaks[:2] for divisor in (2, 3, 4))
+    pitches = {
+        seed + delta for seed in seeds for delta in range(-min(6, max(1, seed // 48)), min(6, max(1, seed // 48)) + 1)
+        if min_size <= seed + delta <= length // 2
+    }
+    # Sparse sheets repeat too little for a clear peak, pitches that tile the sheet are always tried
+    pitches = sorted(pitches.union(int(lag) for lag in lags if length % lag == 0))
+    # Lines in the transparent margins around the content are clean whatever the pitch, only the lines between the
+    # first and last opaque pixel tell grid lines apart from lines through a sprite
+    first, last = np.flatnonzero(profile)[[0, -1]]
+    base = crossing[first + 1:last + 1].mean() if last > first else 0.0
+    candidates = []
+    # Zero padded so every fold below is a reshape of a prefix
+    padded_crossing = np.zeros(2 * length)
+    padded_crossing[:length] = crossing[:length]
+    inside = np.zeros(2 * length)
+    inside[first + 1:last + 1] = 1
+    for pitch in pitches:
+        # Fold the lines by pitch to score every phase of the grid lines at once, a phase without lines inside the
+        # content has no evidence for it and scores as if crossed as often as the average line
+        folds = -(-length // pitch) * pitch
+        counts = inside[:folds].reshape(-1, pitch).sum(axis=0)
+        crossed = np.where(counts > 0, padded_crossing[:folds].reshape(-1, pitch).sum(axis=0) / np.maximum(counts, 1), base)
+        clean = 1 - crossed / base if base > 0 else np.ones(pitch)
+        offset = int(clean.argmax())
+        if clean[0] >= clean[offset] - 0.05:
+            offset = 0
+        score = periodicity[pitch] * (0.5 + 0.5 * max(clean[offset], 0.0))
+        # With only a few lines some phase of almost any pitch is clean, a grid starting at the sheet edge is trusted
+        # before one that needs an offset
+        if periodicity[pitch] > 0 and clean[0] >= 0.8:
+            rank = 2
+            offset = 0
+        elif periodicity[pitch] > 0.3 and clean[offset] >= 0.8:
+            rank = 1
+        elif periodicity[pitch] >= 0.75 and clean[offset] >= 0.4:
+            # Sprites that touch their neighbours still leave the grid lines cleaner than the rest of a strongly
+            # repeating sheet
+            rank = 0
+        else:
+            continue
+        candidates.append((pitch, offset, score, rank))
+    # Multiples of the true pitch score about as well as the pitch itself, so take the smallest pitch near the best
+    # score, among those whose grid lines content hardly ever straddles if there are any. Its neighbours score almost
+    # as well, and one that tiles the sheet is preferred over any that doesn't.
+    if not candidates:
+        # No pitch has grid lines that content keeps clear of, the axis holds a single cell
+        return length, 0, 0
+    best_rank = max(candidate[3] for candidate in candidates)
+    candidates = [candidate for candidate in candidates if candidate[3] == best_rank]
+    # Clean lines from the sheet edge are strong evidence on their own, sparse sheets barely repeat at their pitch
+    best_score = max(candidate[2] for candidate in candidates)
+    smallest = min(candidate[0] for candidate in candidates if candidate[2] >= (0.2 if best_rank == 2 else 0.6) * best_score)
+    spread = 2 * max(1, smallest // 48)
+    near = [candidate for candidate in candidates if smallest <= candidate[0] <= smallest + spread]
+    tiling = [candidate for candidate in near if length % candidate[0] == 0]
+    pitch, line_offset, _, _ = max(tiling or near, key=lambda candidate: candidate[2])
+    # Phases (relative to the sheet start) that hold content in any cell along this axis
+    folded = np.zeros(-(-length // pitch) * pitch, dtype=bool)
+    folded[:length] = profile > 0
+    occupied = folded.reshape(-1, pitch).any(axis=0)
+    if occupied.all() or (not occupied[0] and length % pitch == 0):
+        return pitch, 0, 0
+    # Longest run of empty phases, walking around the pitch cyclically
+    empty = np.concatenate([~occupied, ~occupied])
+    run_start, run_length, best_start, best_length = 0, 0, 0, 0
+    for phase, is_empty in enumerate(empty):
+        if is_empty:
+            if run_length == 0:
+                run_start = phase
+            run_length += 1
+            if run_length > best_length:
+                best_start, best_length = run_start, min(run_length, pitch)
+        else:
+            run_length = 0
+    offset = (best_start + best_length) % pitch
+    # A narrow band that is empty in every cell is the spacing between cells when it explains why the pitch doesn't
+    # tile the sheet. When the pitch tiles it already, the band is margin that happens to be empty in every cell.
+    if best_length < pitch // 4 and length % pitch and ((length - offset) % pitch == 0 or (length - offset + best_length) % pitch == 0):
+        return pitch - best_length, offset, best_length
+    # A wide band is transparent margin inside the cells, the grid line falls on the cleanest phase
+    return pitch, line_offset, 0
+
+def detect_sprite_grid(spritesheet, min_size=8):
+    if spritesheet.get_flags() & pygame.SRCALPHA:
+        alpha = pygame.surfarray.pixels_alpha(spritesheet)
+    else:
+        alpha = pygame.surfarray.array_alpha(spritesheet)
+    opaque = alpha > 0
+    del alpha
+    straddle_x = np.count_nonzero(opaque[:-1] & opaque[1:], axis=1)
+    straddle_y = np.count_nonzero(opaque[:, :-1] & opaque[:, 1:], axis=0)
+    sprite_width, offset_x, padding_x = detect_grid_axis(np.count_nonzero(opaque, axis=1), straddle_x, min_size)
+    sprite_height, offset_y, padding_y = detect_grid_axis(np.count_nonzero(opaque, axis=0), straddle_y, min_size)
+    return SpriteGrid(
+        sprite_width=sprite_width,
+        sprite_height=sprite_height,
+        offset_x=offset_x,
+        offset_y=offset_y,
+        padding_x=padding_x,
+        padding_y=padding_y
+    )
+
+def pack_shelves(sizes, max_width=None):
+    # Lays frames out left to right in rows, wrapping near the square root of their total area
+    if not sizes:
+        return 0, 0, []
+    if max_width is None:
+        area = sum(width * height for width, height in sizes)
+        max_width = max(max(width for width, _ in sizes), math.ceil(math.sqrt(area)))
+    rects = []
+    x = y = shelf_height = atlas_width = 0
+    for width, height in sizes:
+        if x + width > max_width and x > 0:
+            y += shelf_height
+            x = shelf_height = 0
+        rects.append((x, y, width, height))
+        x += width
+        shelf_height = max(shelf_height, height)
+        atlas_width = max(atlas_width, x)
+    return atlas_width, y + shelf_height, rects
+
+def masked_pixels(image):
+    # Fully transparent pixels hash the same whatever color they carry
+    if image.get_bytesize() == 4 and image.get_flags() & pygame.SRCALPHA:
+        # Reading through views skips the slow per-pixel copies of array2d and array_alpha
+        pixels = pygame.surfarray.pixels2d(image)
+        alpha = pygame.surfarray.pixels_alpha(image)
+        masked = np.where(alpha == 0, 0, pixels).view(np.int32)
+        del pixels, alpha
+        return masked
+    pixels = pygame.surfarray.array2d(image)
+    pixels[pygame.surfarray.array_alpha(image) == 0] = 0
+    return pixels
+
+def frame_content_hash(image, pixels=None):
+    if pixels is None:
+        pixels = masked_pixels(image)
+    return pixels_content_hash(image.get_size(), pixels)
+
+def pixels_content_hash(size, pixels):
+    content_hash = hashlib.blake2b(digest_size=16)
+    content_hash.update(np.array(size, dtype=np.int32).tobytes())
+    content_hash.update(pixels.tobytes())
+    return content_hash.hexdigest()
+
+def copy_pixels(surface, copies):
+    # Copies (source, dest, area) onto a cleared SRCALPHA surface. A plain blit would alpha blend translucent
+    # pixels with the cleared background, RGBA_MAX keeps every channel of the source exactly
+    surface.blits([(source, dest, area, pygame.BLEND_RGBA_MAX) for source, dest, area in copies], doreturn=False)
+
+def pack_frames(sources, format_surface):
+    # Copies (surface, area) sources into one surface with format_surface's pixel format,
+    # returns it and the (x, y, w, h) rect of every source in it
+    width, height, rects = pack_shelves([tuple(area[2:]) for _, area in sources])
+    surface = pygame.Surface((width, height), pygame.SRCALPHA, format_surface)
+    copy_pixels(surface, [(source, rect[:2], area) for (source, area), rect in zip(sources, rects)])
+    return surface, np.array(rects, dtype=np.int32).reshape(-1, 4)
+
+def write_save_job(job):
+    file_path, width, height, rgba = job
+    if file_path.endswith(".rgba"):
+        write_file_atomic(file_path, rgba)
+    else:
+        write_png(file_path, width, height, rgba)
+
+def slice_spritesheet(spritesheet, sprite_width, sprite_height, offset_x=0, offset_y=0, padding_x=0, padding_y=0, frame_pool=None, trim=False):
+    # Identical frames share one surface; pass the same frame_pool dict to share them across sheets too.
+    # With trim=True each frame keeps only its opaque bounds and records where they sit in the cell.
+    cells, bounds = find_occupied_cells(spritesheet, sprite_width, sprite_height, offset_x, offset_y, padding_x, padding_y)
+    pitch_x = sprite_width + padding_x
+    pitch_y = sprite_height + padding_y
+    if frame_pool is None:
+        frame_pool = {}
+    pixels = masked_pixels(spritesheet)
+    states = []
+    for row, row_cells in groupby(zip(cells.tolist(), bounds.tolist()), key=lambda cell: cell[0][0]):
+        sprites = []
+        for (_, column), cell_bounds in row_cells:
+            cell_x, cell_y = offset_x + column * pitch_x, offset_y + row * pitch_y
+            if trim:
+                x, y, width, height = cell_bounds
+                trim_offset = [x - cell_x, y - cell_y]
+            else:
+                x, y, width, height = cell_x, cell_y, sprite_width, sprite_height
+                trim_offset = None
+            image = spritesheet.subsurface((x, y, width, height))
+            content_hash = frame_content_hash(image, pixels[x:x + width, y:y + height])
+            image = frame_pool.setdefault(content_hash, image)
+            sprites.append(Sprite(image=image, image_url="", content_hash=content_hash, trim_offset=trim_offset))
+        states.append(StateSequence(name=f"State{len(states)}", sprites=sprites))
+    return states
+
 class SpriteEntity(BaseModel):
     name: str
     states: List[StateSequence]
@@ -28,39 +416,108 @@ class SpriteEntity(BaseModel):
     description: str = ""
     sprite_width: int = 0
     sprite_height: int = 0
+    offset_x: int = 0
+    offset_y: int = 0
+    padding_x: int = 0
+    padding_y: int = 0
+    atlas_url: str = ""
+    atlas_width: int = 0
+    atlas_height: int = 0
 
     class Config:
         arbitrary_types_allowed = True
 
     @classmethod
-    def load_from_file(cls, file_path):
+    def load_from_file(cls, file_path, lazy=False):
+        # With lazy=True only the metadata is read, frames decode on first get_image()
         with open(file_path, 'r') as file:
             data = json.load(file)
         sprite_entity = cls(**data)
-        for state in sprite_entity.states:
-            for sprite in state.sprites:
-                sprite.load_image()
+        if sprite_entity.atlas_url:
+            atlas = sprite_entity.load_atlas()
+            for state in sprite_entity.states:
+                for sprite in state.sprites:
+                    sprite.image = atlas.subsurface(sprite.rect)
+        elif not lazy:
+            images = {}
+            for state in sprite_entity.states:
+                state.load_images(images)
         return sprite_entity
 
+    def load_atlas(self):
+        if self.atlas_url.endswith(".rgba"):
+            # Map the raw pixels instead of reading them, frames are only paged in when drawn
+            buffer = np.memmap(self.atlas_url, dtype=np.uint8, mode="c", shape=(self.atlas_height, self.atlas_width, 4))
+            return pygame.image.frombuffer(buffer, (self.atlas_width, self.atlas_height), "RGBA")
+        return pygame.image.load(self.atlas_url).convert_alpha()
+
+    def prepare_atlas(self, folder_path, atlas_format):
+        # Packs the atlas and points every sprite at its rect, returns the write job for the atlas file
+        if atlas_format not in ATLAS_FORMATS:
+            raise ValueError(f"Unknown atlas format '{atlas_format}', expected one of {ATLAS_FORMATS}")
+        sprites = [sprite for state in self.states for sprite in state.sprites]
+        unique_images = {}
+        for sprite in sprites:
+            image = sprite.get_image()
+            sprite.content_hash = sprite.content_hash or frame_content_hash(image)
+            unique_images.setdefault(sprite.content_hash, image)
+        atlas_width, atlas_height, rects = pack_shelves([image.get_size() for image in unique_images.values()])
+        atlas = pygame.Surface((atlas_width, atlas_height), pygame.SRCALPHA, 32)
+        copy_pixels(atlas, [(image, rect[:2], None) for image, rect in zip(unique_images.values(), rects)])
+        frame_rects = {content_hash: list(rect) for content_hash, rect in zip(unique_images, rects)}
+        for sprite in sprites:
+            sprite.rect = frame_rects[sprite.content_hash]
+            sprite.image_url = ""
+            if sprite.image is None:
+                # Lazily loaded sprites lose their file here, they read from the atlas like a loaded atlas entity
+                sprite.image = atlas.subsurface(sprite.rect)
+        self.atlas_url = os.path.join(folder_path, f"atlas.{atlas_format}")
+        self.atlas_width = atlas_width
+        self.atlas_height = atlas_height
+        return (self.atlas_url, atlas_width, atlas_height, pygame.image.tobytes(atlas, "RGBA"))
+
+    def prepare_frames(self, folder_path):
+        # Points every sprite at the PNG of its first occurrence, returns a write job per unique frame
+        # and the lazily loaded sprites whose decoded images have to stay pinned until the files exist
+        self.atlas_url = ""
+        self.atlas_width = self.atlas_height = 0
+        jobs = []
+        pinned_sprites = []
+        written = {}
+        for state_index, state in enumerate(self.states):
+            for sprite_index, sprite in enumerate(state.sprites):
+                image = sprite.get_image()
+                sprite.content_hash = sprite.content_hash or frame_content_hash(image)
+                if sprite.image is None:
+                    sprite.image = image
+                    pinned_sprites.append(sprite)
+                # Duplicate frames point at the file written for their first occurrence
+                image_url = written.get(sprite.content_hash)
+                if image_url is None:
+                    image_url = os.path.join(folder_path, f"state_{state_index}_sprite_{sprite_index}.png")
+                    jobs.append((image_url, image.get_width(), image.get_height(), pygame.image.tobytes(image, "RGBA")))
+                    written[sprite.content_hash] = image_url
+                sprite.image_url = image_url
+                sprite.rect = None
+        return jobs, pinned_sprites
+
     @classmethod
-    def load_from_spritesheet(cls, spritesheet_path, sprite_width, sprite_height):
+    def load_from_spritesheet(cls, spritesheet_path, sprite_width=None, sprite_height=None, frame_pool=None, trim=False):
         spritesheet = pygame.image.load(spritesheet_path).convert_alpha()
-        states = []
-        for y in range(0, spritesheet.get_height(), sprite_height):
-            sprites = []
-            for x in range(0, spritesheet.get_width(), sprite_width):
-                sprite_image = spritesheet.subsurface((x, y, sprite_width, sprite_height))
-                if not cls.is_sprite_empty(sprite_image):
-                    sprite = Sprite(image=sprite_image, image_url="")
-                    sprites.append(sprite)
-            if sprites:
-                states.append(StateSequence(name=f"State{len(states)}", sprites=sprites))
+        return cls.from_spritesheet(spritesheet, spritesheet_path, sprite_width, sprite_height, frame_pool, trim)
+
+    @classmethod
+    def from_spritesheet(cls, spritesheet, spritesheet_path, sprite_width=None, sprite_height=None, frame_pool=None, trim=False):
+        # Without a sprite size the grid is detected from the sheet itself
+        if sprite_width is None or sprite_height is None:
+            grid = detect_sprite_grid(spritesheet)
+        else:
+            grid = SpriteGrid(sprite_width=sprite_width, sprite_height=sprite_height)
         sprite_entity = cls(
             name=os.path.splitext(os.path.basename(spritesheet_path))[0],
-            states=states,
+            states=slice_spritesheet(spritesheet, frame_pool=frame_pool, trim=trim, **grid.dict()),
             source=spritesheet_path,
-            sprite_width=sprite_width,
-            sprite_height=sprite_height
+            **grid.dict()
         )
         return sprite_entity
 
@@ -68,24 +525,506 @@ class SpriteEntity(BaseModel):
     def is_sprite_empty(sprite_image):
         return not bool(sprite_image.get_bounding_rect())
 
-    def save_to_file(self, folder_path):
+    def trim_frames(self):
+        # Trims frames that still hold their full cell, e.g. entities saved before trimming existed
+        trimmed_images = {}
+        for state in self.states:
+            for sprite in state.sprites:
+                if sprite.trim_offset is not None:
+                    continue
+                image = sprite.get_image()
+                bounds = image.get_bounding_rect()
+                image = image.subsurface(bounds)
+                content_hash = frame_content_hash(image)
+                sprite.image = trimmed_images.setdefault(content_hash, image)
+                sprite.content_hash = content_hash
+                sprite.trim_offset = [bounds.x, bounds.y]
+                sprite.image_url = ""
+                sprite.rect = None
+
+    def save_to_file(self, folder_path, atlas_format=None, catalog_path=None, workers=SAVE_WORKERS):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            self.start_save(folder_path, executor, atlas_format, catalog_path).result()
+
+    def start_save(self, folder_path, executor, atlas_format=None, catalog_path=None, progress=None):
+        # Everything touching surfaces or the models runs on the calling thread; PNG encoding and the file
+        # writes run on the executor. The returned Future is done once metadata.json is written and
+        # progress, if given, is called with (files written, files total) from the executor's threads.
+        # The entity is only recorded in a catalog when catalog_path is given.
+        if atlas_format is not None and atlas_format not in ATLAS_FORMATS:
+            raise ValueError(f"Unknown atlas format '{atlas_format}', expected one of {ATLAS_FORMATS}")
         os.makedirs(folder_path, exist_ok=True)
-        for state_index, state in enumerate(self.states):
-            for sprite_index, sprite in enumerate(state.sprites):
-                image_url = os.path.join(folder_path, f"state_{state_index}_sprite_{sprite_index}.png")
-                pygame.image.save(sprite.image, image_url)
-                sprite.image_url = image_url
+        if atlas_format is not None:
+            jobs, pinned_sprites = [self.prepare_atlas(folder_path, atlas_format)], []
+        else:
+            jobs, pinned_sprites = self.prepare_frames(folder_path)
+        for image_url, _, _, _ in jobs:
+            decoded_image_cache.discard(image_url)
+        data = self.dict(exclude={'states': {'__all__': {'sprites': {'__all__': {'image'}}}}})
+
+        saved = Future()
+        remaining = [len(jobs)]
+        lock = threading.Lock()
+
+        def write_metadata():
+            write_file_atomic(os.path.join(folder_path, "metadata.json"), json.dumps(data, indent=4).encode())
+            if catalog_path is not None:
+                with SpriteCatalog(catalog_path) as catalog:
+                    catalog.upsert(SpriteEntity.parse_obj(data), folder_path)
+            # The files exist now, lazily loaded sprites can decode them again on demand
+            for sprite in pinned_sprites:
                 sprite.image = None
-        data = self.dict(exclude={'states': {'sprites': {'image'}}})
-        with open(os.path.join(folder_path, "metadata.json"), 'w') as file:
-            json.dump(data, file, indent=4)
-        # Reload the images after saving
+
+        def job_done(future):
+            with lock:
+                if saved.done():
+                    return
+                if future.exception() is not None:
+                    saved.set_exception(future.exception())
+                    return
+                remaining[0] -= 1
+                written = len(jobs) - remaining[0]
+            if progress is not None:
+                progress(written, len(jobs))
+            if written == len(jobs):
+                try:
+                    write_metadata()
+                    saved.set_result(folder_path)
+                except Exception as e:
+                    saved.set_exception(e)
+
+        if not jobs:
+            write_metadata()
+            saved.set_result(folder_path)
+        for job in jobs:
+            executor.submit(write_save_job, job).add_done_callback(job_done)
+        return saved
+
+    def dedup_stats(self):
+        sprites = [sprite for state in self.states for sprite in state.sprites]
+        unique_bytes = {}
+        total_bytes = 0
+        for sprite in sprites:
+            image = sprite.get_image()
+            content_hash = sprite.content_hash or frame_content_hash(image)
+            unique_bytes[content_hash] = SurfaceCache.surface_bytes(image)
+            total_bytes += SurfaceCache.surface_bytes(image)
+        return {
+            "frames": len(sprites),
+            "unique_frames": len(unique_bytes),
+            "bytes": total_bytes,
+            "bytes_saved": total_bytes - sum(unique_bytes.values())
+        }
+
+class FrameView:
+    # Sprite-like view of one frame of a FrameStore, created on access and holding no data of its own
+    __slots__ = ("store", "index")
+    image_url = ""
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def name(self):
+        return self.store.frame_names.get(self.index, "")
+
+    @name.setter
+    def name(self, name):
+        self.store.frame_names[self.index] = name
+
+    @property
+    def description(self):
+        return self.store.frame_descriptions.get(self.index, "")
+
+    @description.setter
+    def description(self, description):
+        self.store.frame_descriptions[self.index] = description
+
+    @property
+    def rect(self):
+        return self.store.rects[self.store.frame_unique[self.index]].tolist()
+
+    @property
+    def content_hash(self):
+        return self.store.hashes[self.store.frame_unique[self.index]]
+
+    @property
+    def trim_offset(self):
+        x, y = self.store.trim_offsets[self.index].tolist()
+        return None if x < 0 else [x, y]
+
+    @property
+    def image(self):
+        return self.store.image(self.store.frame_unique[self.index])
+
+    def get_image(self):
+        return self.store.image(self.store.frame_unique[self.index])
+
+    placement = Sprite.placement
+
+class FrameSequence:
+    # The frames of one state, indexes like the sprites list of a StateSequence
+    __slots__ = ("store", "start", "stop")
+
+    def __init__(self, store, start, stop):
+        self.store = store
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sprite index out of range")
+        return FrameView(self.store, self.start + index)
+
+    def __iter__(self):
+        return (FrameView(self.store, index) for index in range(self.start, self.stop))
+
+class StateView:
+    __slots__ = ("store", "index", "sprites")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.sprites = FrameSequence(store, int(store.state_starts[index]), int(store.state_starts[index + 1]))
+
+    @property
+    def name(self):
+        return self.store.state_names[self.index]
+
+    @name.setter
+    def name(self, name):
+        self.store.state_names[self.index] = name
+
+    @property
+    def description(self):
+        return self.store.state_descriptions[self.index]
+
+    @description.setter
+    def description(self, description):
+        self.store.state_descriptions[self.index] = description
+
+    def load_images(self, images=None):
+        pass
+
+class FrameStore:
+    # Compact stand-in for a SpriteEntity sliced from a sheet. The unique frames are copied into one surface and
+    # every frame is a row in parallel arrays (its unique frame, trim offset and state), so a sheet costs a handful
+    # of objects instead of a pydantic Sprite and a subsurface per frame. states and sprites are views with the
+    # attributes and methods the viewer and the save code use; to_sprite_entity() gives the pydantic models.
+    def __init__(self, name, surface, rects, hashes, frame_unique, state_starts, trim_offsets=None, source="", description="",
+                 sprite_width=0, sprite_height=0, offset_x=0, offset_y=0, padding_x=0, padding_y=0):
+        self.name = name
+        self.source = source
+        self.description = description
+        self.sprite_width = sprite_width
+        self.sprite_height = sprite_height
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.padding_x = padding_x
+        self.padding_y = padding_y
+        self.surface = surface
+        self.rects = rects  # (unique frames, 4) x, y, w, h in surface
+        self.hashes = hashes
+        self.frame_unique = frame_unique  # (frames,) index into rects and hashes
+        self.state_starts = state_starts  # (states + 1,) first frame of every state
+        # (frames, 2) offset of the frame within its cell, -1 for frames holding their full cell
+        self.trim_offsets = trim_offsets if trim_offsets is not None else np.full((len(frame_unique), 2), -1, dtype=np.int32)
+        self.images = [None] * len(hashes)
+        self.state_names = [f"State{index}" for index in range(len(state_starts) - 1)]
+        self.state_descriptions = [""] * (len(state_starts) - 1)
+        self.frame_names = {}
+        self.frame_descriptions = {}
+        self.states = [StateView(self, index) for index in range(len(state_starts) - 1)]
+
+    @classmethod
+    def load_from_spritesheet(cls, spritesheet_path, sprite_width=None, sprite_height=None, trim=False):
+        spritesheet = pygame.image.load(spritesheet_path).convert_alpha()
+        return cls.from_spritesheet(spritesheet, spritesheet_path, sprite_width, sprite_height, trim)
+
+    @classmethod
+    def from_spritesheet(cls, spritesheet, spritesheet_path, sprite_width=None, sprite_height=None, trim=False):
+        # Slices like SpriteEntity.from_spritesheet, the store keeps no reference to the sheet
+        if sprite_width is None or sprite_height is None:
+            grid = detect_sprite_grid(spritesheet)
+        else:
+            grid = SpriteGrid(sprite_width=sprite_width, sprite_height=sprite_height)
+        cells, bounds = find_occupied_cells(spritesheet, **grid.dict())
+        cell_origins = np.stack([
+            grid.offset_x + cells[:, 1] * (grid.sprite_width + grid.padding_x),
+            grid.offset_y + cells[:, 0] * (grid.sprite_height + grid.padding_y)
+        ], axis=1).astype(np.int32)
+        if trim:
+            frame_rects = bounds
+            trim_offsets = (bounds[:, :2] - cell_origins).astype(np.int32)
+        else:
+            frame_rects = np.concatenate([cell_origins, np.broadcast_to([grid.sprite_width, grid.sprite_height], (len(cells), 2))], axis=1)
+            trim_offsets = None
+        pixels = masked_pixels(spritesheet)
+        unique_indices = {}
+        sources = []
+        frame_unique = np.empty(len(cells), dtype=np.int32)
+        for frame_index, (x, y, width, height) in enumerate(frame_rects.tolist()):
+            content_hash = pixels_content_hash((width, height), pixels[x:x + width, y:y + height])
+            unique_index = unique_indices.setdefault(content_hash, len(unique_indices))
+            if unique_index == len(sources):
+                sources.append((spritesheet, (x, y, width, height)))
+            frame_unique[frame_index] = unique_index
+        surface, rects = pack_frames(sources, spritesheet)
+        # Occupied cells come in row-major order, every row of the sheet is a state
+        state_starts = np.concatenate([[0], np.flatnonzero(np.diff(cells[:, 0])) + 1, [len(cells)]]) if len(cells) else np.zeros(1, dtype=np.intp)
+        return cls(
+            os.path.splitext(os.path.basename(spritesheet_path))[0], surface, rects, list(unique_indices), frame_unique, state_starts,
+            trim_offsets, source=spritesheet_path, **grid.dict()
+        )
+
+    @classmethod
+    def from_sprite_entity(cls, sprite_entity):
+        sprites = [sprite for state in sprite_entity.states for sprite in state.sprites]
+        unique_indices = {}
+        sources = []
+        frame_unique = np.empty(len(sprites), dtype=np.int32)
+        trim_offsets = np.full((len(sprites), 2), -1, dtype=np.int32)
+        for frame_index, sprite in enumerate(sprites):
+            image = sprite.get_image()
+            unique_index = unique_indices.setdefault(sprite.content_hash or frame_content_hash(image), len(unique_indices))
+            if unique_index == len(sources):
+                sources.append((image, (0, 0, *image.get_size())))
+            frame_unique[frame_index] = unique_index
+            if sprite.trim_offset is not None:
+                trim_offsets[frame_index] = sprite.trim_offset
+        surface, rects = pack_frames(sources, sources[0][0] if sources else pygame.Surface((0, 0), pygame.SRCALPHA, 32))
+        state_starts = np.cumsum([0] + [len(state.sprites) for state in sprite_entity.states])
+        frame_store = cls(
+            sprite_entity.name, surface, rects, list(unique_indices), frame_unique, state_starts, trim_offsets,
+            source=sprite_entity.source, description=sprite_entity.description, sprite_width=sprite_entity.sprite_width,
+            sprite_height=sprite_entity.sprite_height, offset_x=sprite_entity.offset_x, offset_y=sprite_entity.offset_y,
+            padding_x=sprite_entity.padding_x, padding_y=sprite_entity.padding_y
+        )
+        for state, state_view in zip(sprite_entity.states, frame_store.states):
+            state_view.name = state.name
+            state_view.description = state.description
+            for sprite, frame_view in zip(state.sprites, state_view.sprites):
+                if sprite.name:
+                    frame_view.name = sprite.name
+                if sprite.description:
+                    frame_view.description = sprite.description
+        return frame_store
+
+    def to_sprite_entity(self):
+        # The Sprites share the store's subsurfaces, no pixels are copied
+        states = []
         for state in self.states:
-            for sprite in state.sprites:
-                sprite.load_image()
+            sprites = [
+                Sprite.construct(
+                    name=sprite.name, image_url="", description=sprite.description, content_hash=sprite.content_hash,
+                    trim_offset=sprite.trim_offset, image=sprite.get_image()
+                )
+                for sprite in state.sprites
+            ]
+            states.append(StateSequence.construct(name=state.name, sprites=sprites, description=state.description))
+        return SpriteEntity.construct(
+            name=self.name, states=states, source=self.source, description=self.description, sprite_width=self.sprite_width,
+            sprite_height=self.sprite_height, offset_x=self.offset_x, offset_y=self.offset_y, padding_x=self.padding_x,
+            padding_y=self.padding_y
+        )
+
+    def image(self, unique_index):
+        image = self.images[unique_index]
+        if image is None:
+            image = self.images[unique_index] = self.surface.subsurface(self.rects[unique_index].tolist())
+        return image
+
+    def memory_bytes(self):
+        arrays = (self.rects, self.frame_unique, self.state_starts, self.trim_offsets)
+        return SurfaceCache.surface_bytes(self.surface) + sum(array.nbytes for array in arrays)
+
+    def trim_frames(self):
+        # Like SpriteEntity.trim_frames, then repacks the surface so the cropped borders are freed
+        trimmed = {}
+        unique_indices = {content_hash: index for index, content_hash in enumerate(self.hashes)}
+        sources = [(self.surface, rect) for rect in self.rects.tolist()]
+        for frame_index in np.flatnonzero(self.trim_offsets[:, 0] < 0).tolist():
+            unique_index = int(self.frame_unique[frame_index])
+            if unique_index not in trimmed:
+                image = self.image(unique_index)
+                bounds = image.get_bounding_rect()
+                content_hash = frame_content_hash(image.subsurface(bounds))
+                trimmed_index = unique_indices.setdefault(content_hash, len(unique_indices))
+                if trimmed_index == len(sources):
+                    x, y = self.rects[unique_index, :2].tolist()
+                    sources.append((self.surface, (x + bounds.x, y + bounds.y, bounds.width, bounds.height)))
+                trimmed[unique_index] = trimmed_index, (bounds.x, bounds.y)
+            self.frame_unique[frame_index], self.trim_offsets[frame_index] = trimmed[unique_index]
+        if not trimmed:
+            return
+        hashes = list(unique_indices)
+        used = np.unique(self.frame_unique)
+        remap = np.zeros(len(sources), dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        self.surface, self.rects = pack_frames([sources[index] for index in used.tolist()], self.surface)
+        self.hashes = [hashes[index] for index in used.tolist()]
+        self.frame_unique = remap[self.frame_unique]
+        self.images = [None] * len(self.hashes)
+
+    def save_to_file(self, folder_path, atlas_format=None, catalog_path=None, workers=SAVE_WORKERS):
+        self.to_sprite_entity().save_to_file(folder_path, atlas_format, catalog_path, workers)
+
+    def start_save(self, folder_path, executor, atlas_format=None, catalog_path=None, progress=None):
+        return self.to_sprite_entity().start_save(folder_path, executor, atlas_format, catalog_path, progress)
+
+    def dedup_stats(self):
+        unique_bytes = self.rects[:, 2].astype(np.int64) * self.rects[:, 3] * self.surface.get_bytesize()
+        total_bytes = int(unique_bytes[self.frame_unique].sum())
+        return {
+            "frames": len(self.frame_unique),
+            "unique_frames": len(self.hashes),
+            "bytes": total_bytes,
+            "bytes_saved": total_bytes - int(unique_bytes.sum())
+        }
+
+class ScaledSurfaceCache(SurfaceCache):
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        super().__init__(max_bytes)
+
+    def get(self, surface, size):
+        # Keyed by the surface object itself so a recycled id() can never alias a stale entry
+        return self.get_or_create((surface, size), lambda: pygame.transform.scale(surface, size))
+
+class TextCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+
+    def get_font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = pygame.font.Font(None, size)
+            self.fonts[size] = font
+        return font
+
+    def render(self, text, size, color):
+        key = (text, size, color)
+        text_surface = self.surfaces.get(key)
+        if text_surface is not None:
+            self.surfaces.move_to_end(key)
+            return text_surface
+        text_surface = self.get_font(size).render(text, True, color)
+        self.surfaces[key] = text_surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return text_surface
+
+class SpritesheetLayout:
+    # Where compose_spritesheet put each frame, clicks and the selection border are plain arithmetic on it
+    def __init__(self, left, top, cell_width, cell_height, row_lengths):
+        self.left = left
+        self.top = top
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.row_lengths = row_lengths
+
+    def cell_rect(self, state_index, sprite_index):
+        return pygame.Rect(self.left + sprite_index * self.cell_width, self.top + state_index * self.cell_height, self.cell_width, self.cell_height)
+
+    def hit_test(self, position):
+        # Returns (state_index, sprite_index) of the cell under position or None, edges match Rect.collidepoint
+        if self.cell_width <= 0 or self.cell_height <= 0:
+            return None
+        state_index = (position[1] - self.top) // self.cell_height
+        sprite_index = (position[0] - self.left) // self.cell_width
+        if 0 <= state_index < len(self.row_lengths) and 0 <= sprite_index < self.row_lengths[state_index]:
+            return state_index, sprite_index
+        return None
+
+class SpritesheetLoader:
+    # Decodes and slices spritesheets on worker threads and keeps the results in a
+    # memory-budgeted LRU keyed by (path, sprite_width, sprite_height). Decoded sheets are
+    # cached per path as well, so slicing the same sheet at another size never touches the disk.
+    def __init__(self, max_bytes=512 * 1024 * 1024, spritesheet_max_bytes=256 * 1024 * 1024, workers=2):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entities = OrderedDict()
+        self.spritesheets = SurfaceCache(spritesheet_max_bytes)
+        self.pending = {}
+        self.prefetching = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spritesheet-loader")
+
+    def request(self, spritesheet_path, sprite_width, sprite_height):
+        key = (spritesheet_path, sprite_width, sprite_height)
+        with self.lock:
+            # Once asked for directly a sheet is no longer a prefetch that may be cancelled
+            self.prefetching.pop(key, None)
+            if key in self.entities:
+                self.entities.move_to_end(key)
+                future = Future()
+                future.set_result(self.entities[key])
+                return future
+            if key in self.pending:
+                return self.pending[key]
+            future = self.executor.submit(self.load, spritesheet_path, sprite_width, sprite_height)
+            self.pending[key] = future
+        future.add_done_callback(lambda done: self.store(key, done))
+        return future
+
+    def prefetch(self, requests):
+        # Queued prefetches that are no longer wanted are dropped before they start
+        keys = set(requests)
+        with self.lock:
+            stale = [future for key, future in self.prefetching.items() if key not in keys]
+            self.prefetching = {}
+        for future in stale:
+            future.cancel()
+        for key in requests:
+            future = self.request(*key)
+            if not future.done():
+                with self.lock:
+                    self.prefetching[key] = future
+
+    def get_spritesheet(self, spritesheet_path):
+        with self.lock:
+            spritesheet = self.spritesheets.lookup(spritesheet_path)
+        if spritesheet is None:
+            # Decode outside the lock so workers can load different sheets at the same time
+            spritesheet = pygame.image.load(spritesheet_path).convert_alpha()
+            with self.lock:
+                self.spritesheets.insert(spritesheet_path, spritesheet)
+        return spritesheet
+
+    def load(self, spritesheet_path, sprite_width, sprite_height):
+        spritesheet = self.get_spritesheet(spritesheet_path)
+        if sprite_width is not None and sprite_height is not None:
+            # Adjust sprite width and height based on spritesheet dimensions
+            sprite_width = min(sprite_width, spritesheet.get_width())
+            sprite_height = min(sprite_height, spritesheet.get_height())
+        # Frames are copied out of the sheet, so only the unique frames count against the budget
+        frame_store = FrameStore.from_spritesheet(spritesheet, spritesheet_path, sprite_width, sprite_height)
+        return frame_store, frame_store.memory_bytes()
+
+    def store(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+            self.prefetching.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            sprite_entity, entity_bytes = future.result()
+            self.entities[key] = (sprite_entity, entity_bytes)
+            self.used_bytes += entity_bytes
+            while self.used_bytes > self.max_bytes and len(self.entities) > 1:
+                _, (_, evicted_bytes) = self.entities.popitem(last=False)
+                self.used_bytes -= evicted_bytes
 
 class SpriteManager:
-    def __init__(self, spritesheet_path, sprite_width, sprite_height, scale_factor=1.0):
+    def __init__(self, spritesheet_path, sprite_width, sprite_height, scale_factor=1.0, output_folder=DEFAULT_OUTPUT_FOLDER):
         self.spritesheet_folder = os.path.dirname(spritesheet_path)
         self.spritesheet_files = self.get_spritesheet_files(self.spritesheet_folder)
         self.current_spritesheet_index = self.spritesheet_files.index(os.path.basename(spritesheet_path))
@@ -95,6 +1034,7 @@ class SpriteManager:
         self.sprite_width = sprite_width
         self.sprite_height = sprite_height
         self.scale_factor = scale_factor
+        self.output_folder = output_folder
         self.sprite_entity = None
         self.current_state_index = 0
         self.current_sprite_index = 0
@@ -102,65 +1042,109 @@ class SpriteManager:
         self.speed = 1
         self.frame_delay = 0
         self.frame_timer = 0
+        self.scaled_surface_cache = ScaledSurfaceCache()
+        self.text_cache = TextCache()
+        self.loader = SpritesheetLoader()
+        self.pending_load = None
+        self.save_executor = ThreadPoolExecutor(max_workers=SAVE_WORKERS)
+        self.pending_save = None
+        self.save_progress = (0, 0)
+        self.save_status = ""
+        self.reslice_deadline = None
+        self.spritesheet_grid = None
+        self.preview_rect = None
+        self.text_rect = None
+        self.border_rect = None
         self.load_spritesheet()
+        self.prefetch_neighbours()
 
     
     def get_spritesheet_files(self, folder_path):
         return [file for file in os.listdir(folder_path) if file.endswith(".png")]
     
     def load_spritesheet(self):
+        self.pending_load = None
         try:
-            spritesheet = pygame.image.load(self.spritesheet_path).convert_alpha()
-            spritesheet_width, spritesheet_height = spritesheet.get_size()
+            sprite_entity, _ = self.loader.request(self.spritesheet_path, self.sprite_width, self.sprite_height).result()
+            self.set_sprite_entity(sprite_entity)
+        except (ValueError, pygame.error) as e:
+            print(f"Error loading spritesheet: {str(e)}")
+            self.sprite_entity = None
 
-            # Adjust sprite width and height based on spritesheet dimensions
-            self.sprite_width = min(self.sprite_width, spritesheet_width)
-            self.sprite_height = min(self.sprite_height, spritesheet_height)
-
-            states = []
-            for y in range(0, spritesheet_height, self.sprite_height):
-                sprites = []
-                for x in range(0, spritesheet_width, self.sprite_width):
-                    sprite_rect = pygame.Rect(x, y, self.sprite_width, self.sprite_height)
-                    if sprite_rect.right <= spritesheet_width and sprite_rect.bottom <= spritesheet_height:
-                        sprite_image = spritesheet.subsurface(sprite_rect)
-                        if not self.is_sprite_empty(sprite_image):
-                            sprite = Sprite(image=sprite_image, image_url="")
-                            sprites.append(sprite)
-                if sprites:
-                    states.append(StateSequence(name=f"State{len(states)}", sprites=sprites))
-
-            self.sprite_entity = SpriteEntity(
-                name=os.path.splitext(os.path.basename(self.spritesheet_path))[0],
-                states=states,
-                source=self.spritesheet_path,
-                sprite_width=self.sprite_width,
-                sprite_height=self.sprite_height
-            )
+    def load_spritesheet_in_background(self):
+        self.sprite_entity = None
+        self.pending_load = self.loader.request(self.spritesheet_path, self.sprite_width, self.sprite_height)
+        # Wake an idle event loop as soon as the sheet is ready
+        self.pending_load.add_done_callback(lambda _: pygame.event.post(pygame.event.Event(SPRITESHEET_LOADED)))
+        self.prefetch_neighbours()
+
+    def finish_loading(self):
+        try:
+            sprite_entity, _ = self.pending_load.result()
+            self.set_sprite_entity(sprite_entity)
         except (ValueError, pygame.error) as e:
             print(f"Error loading spritesheet: {str(e)}")
             self.sprite_entity = None
+        self.pending_load = None
 
-    def next_spritesheet(self):
-        self.current_spritesheet_index = (self.current_spritesheet_index + 1) % len(self.spritesheet_files)
-        self.spritesheet_path = os.path.join(self.spritesheet_folder, self.spritesheet_files[self.current_spritesheet_index])
-        self.sprite_width = self.initial_sprite_width
-        self.sprite_height = self.initial_sprite_height
+    def schedule_reslice(self):
+        # Typing "288" would otherwise slice at 2, 28 and 288
+        self.reslice_deadline = time.monotonic() + RESLICE_DELAY
+
+    def reslice(self):
+        self.reslice_deadline = None
+        self.load_spritesheet()
         self.current_state_index = 0
         self.current_sprite_index = 0
-        self.load_spritesheet()
+
+    def detect_grid(self):
+        self.sprite_width = None
+        self.sprite_height = None
+        self.reslice()
+
+    def trim_sprite_entity(self):
+        if self.sprite_entity is not None:
+            self.sprite_entity.trim_frames()
+            self.spritesheet_grid = None
+            self.scaled_surface_cache.clear()
+
+    def cell_size(self):
+        # Trimmed frames are placed relative to the cell size they were sliced with
+        return self.sprite_entity.sprite_width or self.sprite_width, self.sprite_entity.sprite_height or self.sprite_height
+
+    def set_sprite_entity(self, sprite_entity):
+        self.sprite_entity = sprite_entity
+        self.sprite_width = sprite_entity.sprite_width
+        self.sprite_height = sprite_entity.sprite_height
+
+    def prefetch_neighbours(self):
+        neighbour_indices = [
+            (self.current_spritesheet_index + offset) % len(self.spritesheet_files)
+            for offset in (1, -1)
+        ]
+        self.loader.prefetch([
+            (os.path.join(self.spritesheet_folder, self.spritesheet_files[index]), self.initial_sprite_width, self.initial_sprite_height)
+            for index in dict.fromkeys(neighbour_indices)
+            if index != self.current_spritesheet_index
+        ])
+
+    def next_spritesheet(self):
+        self.current_spritesheet_index = (self.current_spritesheet_index + 1) % len(self.spritesheet_files)
+        self.show_spritesheet()
 
     def previous_spritesheet(self):
         self.current_spritesheet_index = (self.current_spritesheet_index - 1) % len(self.spritesheet_files)
+        self.show_spritesheet()
+
+    def show_spritesheet(self):
         self.spritesheet_path = os.path.join(self.spritesheet_folder, self.spritesheet_files[self.current_spritesheet_index])
         self.sprite_width = self.initial_sprite_width
         self.sprite_height = self.initial_sprite_height
         self.current_state_index = 0
         self.current_sprite_index = 0
-        self.load_spritesheet()
+        self.load_spritesheet_in_background()
 
     def render_input_boxes(self, screen, text_boxes, active_text_box):
-        font = pygame.font.Font(None, 24)
         for i, text_box in enumerate(text_boxes):
             if i == active_text_box:
                 pygame.draw.rect(screen, (200, 200, 200), text_box)
@@ -186,12 +1170,17 @@ class SpriteManager:
             #     text = self.sprite_entity.states[self.current_state_index].sprites[self.current_sprite_index].description if self.sprite_entity else ""
             else:
                 text = ""
-            text_surface = font.render(text, True, (0, 0, 0))
+            text_surface = self.text_cache.render(text, 24, (0, 0, 0))
             screen.blit(text_surface, (text_box.x + 5, text_box.y + 5))
 
     def handle_key_events(self, event, active_text_box):
         if active_text_box is None:
-            if self.sprite_entity is not None:
+            # Switching sheets stays available while the next one is still loading
+            if event.key == pygame.K_COMMA:
+                self.previous_spritesheet()
+            elif event.key == pygame.K_PERIOD:
+                self.next_spritesheet()
+            elif self.sprite_entity is not None:
                 if event.key == pygame.K_LEFT:
                     self.current_sprite_index = (self.current_sprite_index - 1) % len(self.sprite_entity.states[self.current_state_index].sprites)
                 elif event.key == pygame.K_RIGHT:
@@ -208,18 +1197,25 @@ class SpriteManager:
                     self.save_sprite_entity()
                 elif event.key == pygame.K_l:
                     self.load_sprite_entity()
-                elif event.key == pygame.K_COMMA:
-                    self.previous_spritesheet()
-                elif event.key == pygame.K_PERIOD:
-                    self.next_spritesheet()
+                elif event.key == pygame.K_g:
+                    self.detect_grid()
+                elif event.key == pygame.K_t:
+                    self.trim_sprite_entity()
         else:
             if event.key == pygame.K_RETURN:
                 active_text_box = None
+                if self.reslice_deadline is not None:
+                    self.reslice()
+            elif active_text_box >= 2 and self.sprite_entity is None:
+                # The entity's names and descriptions can't be edited until its sheet has loaded
+                pass
             elif event.key == pygame.K_BACKSPACE:
                 if active_text_box == 0:
-                    self.sprite_width = int(str(self.sprite_width)[:-1]) if str(self.sprite_width)[:-1] else 0
+                    self.sprite_width = int(str(self.sprite_width or "")[:-1]) if str(self.sprite_width or "")[:-1] else 0
+                    self.schedule_reslice()
                 elif active_text_box == 1:
-                    self.sprite_height = int(str(self.sprite_height)[:-1]) if str(self.sprite_height)[:-1] else 0
+                    self.sprite_height = int(str(self.sprite_height or "")[:-1]) if str(self.sprite_height or "")[:-1] else 0
+                    self.schedule_reslice()
                 elif active_text_box == 2:
                     self.sprite_entity.name = self.sprite_entity.name[:-1]
                 elif active_text_box == 3:
@@ -235,16 +1231,12 @@ class SpriteManager:
             else:
                 if active_text_box == 0:
                     if event.unicode.isdigit():
-                        self.sprite_width = int(str(self.sprite_width) + event.unicode)
-                        self.load_spritesheet()
-                        self.current_state_index = 0
-                        self.current_sprite_index = 0
+                        self.sprite_width = int(str(self.sprite_width or "") + event.unicode)
+                        self.schedule_reslice()
                 elif active_text_box == 1:
                     if event.unicode.isdigit():
-                        self.sprite_height = int(str(self.sprite_height) + event.unicode)
-                        self.load_spritesheet()
-                        self.current_state_index = 0
-                        self.current_sprite_index = 0
+                        self.sprite_height = int(str(self.sprite_height or "") + event.unicode)
+                        self.schedule_reslice()
                 elif active_text_box == 2:
                     self.sprite_entity.name += event.unicode
                 elif active_text_box == 3:
@@ -260,7 +1252,6 @@ class SpriteManager:
         return active_text_box
 
     def render_text_boxes(self, screen, text_boxes, active_text_box):
-        font = pygame.font.Font(None, 24)
         for i, text_box in enumerate(text_boxes):
             if i == active_text_box:
                 pygame.draw.rect(screen, (200, 200, 200), text_box)
@@ -285,13 +1276,12 @@ class SpriteManager:
                 text = self.sprite_entity.states[self.current_state_index].sprites[self.current_sprite_index].description if self.sprite_entity else ""
             else:
                 text = ""
-            text_surface = font.render(text, True, (0, 0, 0))
+            text_surface = self.text_cache.render(text, 24, (0, 0, 0))
             screen.blit(text_surface, (text_box.x + 5, text_box.y + 5))
     
     def render_navigation_buttons(self, screen):
-        font = pygame.font.Font(None, 24)
-        prev_text = font.render("Prev", True, (0, 0, 0))
-        next_text = font.render("Next", True, (0, 0, 0))
+        prev_text = self.text_cache.render("Prev", 24, (0, 0, 0))
+        next_text = self.text_cache.render("Next", 24, (0, 0, 0))
         prev_rect = prev_text.get_rect(center=(screen.get_width() // 2 - 50, 20))
         next_rect = next_text.get_rect(center=(screen.get_width() // 2 + 50, 20))
         pygame.draw.rect(screen, (200, 200, 200), prev_rect.inflate(10, 10))
@@ -301,18 +1291,56 @@ class SpriteManager:
         return prev_rect, next_rect
         
     def save_sprite_entity(self):
-        if self.sprite_entity is not None:
-            base_folder = r"C:\Users\Tommaso\Documents\Dev\SpriteStash\out_sprites"
-            sprite_name = self.sprite_entity.name
-            folder_path = os.path.join(base_folder, sprite_name)
-            self.sprite_entity.save_to_file(folder_path)
-            print(f"Sprite entity saved to {folder_path}")
-            print(self.sprite_entity)
+        # Encoding and writing run in the background, the status line shows the progress
+        if self.sprite_entity is None:
+            return
+        if self.pending_save is not None:
+            print("A save is already in progress")
+            return
+        folder_path = os.path.join(self.output_folder, self.sprite_entity.name)
+        self.save_progress = (0, 0)
+        self.save_status = f"Saving to {folder_path}"
+        catalog_path = os.path.join(self.output_folder, CATALOG_FILE_NAME)
+        self.pending_save = self.sprite_entity.start_save(folder_path, self.save_executor, catalog_path=catalog_path, progress=self.report_save_progress)
+        self.pending_save.add_done_callback(lambda _: pygame.event.post(pygame.event.Event(SPRITE_ENTITY_SAVE_PROGRESS)))
+
+    def report_save_progress(self, written, total):
+        # Called from the save threads, wakes the event loop about every 5% so the status line can redraw
+        self.save_progress = (written, total)
+        if written * 20 // total != (written - 1) * 20 // total:
+            pygame.event.post(pygame.event.Event(SPRITE_ENTITY_SAVE_PROGRESS))
+
+    def update_save_status(self):
+        # Returns True when the status line changed
+        if self.pending_save is None:
+            return False
+        if self.pending_save.done():
+            try:
+                folder_path = self.pending_save.result()
+                self.save_status = f"Saved to {folder_path}"
+                print(f"Sprite entity saved to {folder_path}")
+            except (OSError, ValueError, pygame.error, sqlite3.Error) as e:
+                # The save also updates the catalog, a locked or corrupt catalog must not end the viewer
+                self.save_status = f"Save failed: {e}"
+                print(f"Error saving sprite entity: {str(e)}")
+            self.pending_save = None
+            return True
+        written, total = self.save_progress
+        save_status = f"Saving: {written}/{total} files"
+        if save_status == self.save_status:
+            return False
+        self.save_status = save_status
+        return True
 
     def load_sprite_entity(self):
-        base_folder = r"C:\Users\Tommaso\Documents\Dev\SpriteStash\out_sprites"
         sprite_name = self.sprite_entity.name if self.sprite_entity else ""
-        folder_path = os.path.join(base_folder, sprite_name, "metadata.json")
+        folder_path = os.path.join(self.output_folder, sprite_name, "metadata.json")
+        catalog_path = os.path.join(self.output_folder, CATALOG_FILE_NAME)
+        if sprite_name and os.path.exists(catalog_path):
+            with SpriteCatalog(catalog_path) as catalog:
+                entry = catalog.get(sprite_name)
+            if entry is not None:
+                folder_path = os.path.join(entry["folder"], "metadata.json")
         if os.path.exists(folder_path):
             self.sprite_entity = SpriteEntity.load_from_file(folder_path)
             self.sprite_width = self.sprite_entity.sprite_width
@@ -340,13 +1368,11 @@ class SpriteManager:
         if clicked_input_box is not None:
             return clicked_input_box
         else:
-            if self.sprite_entity is not None:
-                sprite_rects = self.render_spritesheet(screen, play_pause_button_rect)
-                for sprite_rect, state_index, sprite_index in sprite_rects:
-                    if sprite_rect.collidepoint(event.pos):
-                        self.current_state_index = state_index
-                        self.current_sprite_index = sprite_index
-                        break
+            # The layout of the last rendered grid answers the click, nothing is redrawn for it
+            if self.sprite_entity is not None and self.spritesheet_grid is not None and self.spritesheet_grid[0] is self.sprite_entity:
+                hit = self.spritesheet_grid[3].hit_test(event.pos)
+                if hit is not None:
+                    self.current_state_index, self.current_sprite_index = hit
             
             if play_pause_button_rect is not None and play_pause_button_rect.collidepoint(event.pos):
                 self.is_playing = not self.is_playing
@@ -365,18 +1391,16 @@ class SpriteManager:
         return None
 
     def render_play_pause_button(self, screen, position):
-        font = pygame.font.Font(None, 24)
         text = "Pause" if self.is_playing else "Play"
-        text_surface = font.render(text, True, (0, 0, 0))
+        text_surface = self.text_cache.render(text, 24, (0, 0, 0))
         text_rect = text_surface.get_rect(center=position)
         pygame.draw.rect(screen, (200, 200, 200), text_rect.inflate(20, 10))
         screen.blit(text_surface, text_rect)
         return text_rect
 
     def render_speed_control_buttons(self, screen, play_pause_button_rect):
-        font = pygame.font.Font(None, 24)
-        minus_text = font.render("-", True, (0, 0, 0))
-        plus_text = font.render("+", True, (0, 0, 0))
+        minus_text = self.text_cache.render("-", 24, (0, 0, 0))
+        plus_text = self.text_cache.render("+", 24, (0, 0, 0))
         minus_rect = minus_text.get_rect(centerx=play_pause_button_rect.left - 30, centery=play_pause_button_rect.centery)
         plus_rect = plus_text.get_rect(centerx=play_pause_button_rect.right + 30, centery=play_pause_button_rect.centery)
         pygame.draw.rect(screen, (200, 200, 200), minus_rect.inflate(10, 10))
@@ -386,7 +1410,6 @@ class SpriteManager:
         return minus_rect, plus_rect
 
     def render_text(self, screen):
-        font = pygame.font.Font(None, 24)
         spritesheet_name = self.sprite_entity.source.split("\\")[-1]
         state_name = self.sprite_entity.states[self.current_state_index].name
         sprite_name = self.sprite_entity.states[self.current_state_index].sprites[self.current_sprite_index].name
@@ -403,21 +1426,37 @@ class SpriteManager:
             f"Sprite Size: {self.sprite_width}x{self.sprite_height}",
             f"Speed: {self.speed}"
         ]
+        if self.save_status:
+            text_lines.append(self.save_status)
+        text_rect = pygame.Rect(10, 10, 0, 0)
         for i, line in enumerate(text_lines):
-            text_surface = font.render(line, True, (0, 0, 0))
-            screen.blit(text_surface, (10, 10 + i * 30))
+            text_surface = self.text_cache.render(line, 24, (0, 0, 0))
+            text_rect.union_ip(screen.blit(text_surface, (10, 10 + i * 30)))
+        return text_rect
         
 
     def render_error_message(self, screen, message):
-        font = pygame.font.Font(None, 36)
-        text_surface = font.render(message, True, (255, 0, 0))
+        text_surface = self.text_cache.render(message, 36, (255, 0, 0))
         text_rect = text_surface.get_rect(center=(screen.get_width() // 2, screen.get_height() // 2))
         screen.blit(text_surface, text_rect)
 
 
 
     def update(self, dt):
-        if self.is_playing:
+        # Returns True when the shown frame or the status line changed
+        status_changed = self.update_save_status()
+        return self.update_frame(dt) or status_changed
+
+    def update_frame(self, dt):
+        if self.pending_load is not None:
+            if not self.pending_load.done():
+                return False
+            self.finish_loading()
+            return True
+        if self.reslice_deadline is not None and time.monotonic() >= self.reslice_deadline:
+            self.reslice()
+            return True
+        if self.is_playing and self.sprite_entity is not None:
             self.frame_delay = 1 / (self.speed * 5)  # Adjust the frame delay based on the speed
             self.frame_timer += dt
             if self.frame_timer >= self.frame_delay:
@@ -425,16 +1464,53 @@ class SpriteManager:
                 self.current_sprite_index = (self.current_sprite_index + 1) % len(self.sprite_entity.states[self.current_state_index].sprites)
                 if self.current_sprite_index == 0:
                     self.current_state_index = (self.current_state_index + 1) % len(self.sprite_entity.states)
+                return True
+        return False
+
+    def time_until_next_frame(self):
+        # Seconds until update() has something new to show, None while idle
+        timeouts = []
+        if self.reslice_deadline is not None:
+            timeouts.append(max(0, self.reslice_deadline - time.monotonic()))
+        if self.is_playing and self.sprite_entity is not None:
+            timeouts.append(max(0, 1 / (self.speed * 5) - self.frame_timer))
+        return min(timeouts) if timeouts else None
 
     def render_sprite(self, screen, sprite, position, size):
         visualization_scale = 2.0  # Adjust this value to control the visualization size
         scaled_size = (int(size[0] * visualization_scale), int(size[1] * visualization_scale))
-        scaled_sprite = pygame.transform.scale(sprite.image, scaled_size)
-        sprite_rect = scaled_sprite.get_rect(center=position)
-        screen.blit(scaled_sprite, sprite_rect)
+        sprite_rect = pygame.Rect((0, 0), scaled_size)
+        sprite_rect.center = position
+        image_size, (image_x, image_y) = sprite.placement(self.cell_size(), scaled_size)
+        if image_size[0] > 0 and image_size[1] > 0:
+            scaled_sprite = self.scaled_surface_cache.get(sprite.get_image(), image_size)
+            screen.blit(scaled_sprite, (sprite_rect.x + image_x, sprite_rect.y + image_y))
         return sprite_rect
 
     def render_spritesheet(self, screen, play_pause_button_rect):
+        grid_key = (screen.get_size(), play_pause_button_rect.bottom, self.sprite_width, self.sprite_height)
+        if self.spritesheet_grid is None or self.spritesheet_grid[0] is not self.sprite_entity:
+            # A different entity means none of the cached thumbnails can be reused
+            self.scaled_surface_cache.clear()
+            self.spritesheet_grid = None
+        if self.spritesheet_grid is None or self.spritesheet_grid[1] != grid_key:
+            grid_surface, layout = self.compose_spritesheet(screen, play_pause_button_rect)
+            self.spritesheet_grid = (self.sprite_entity, grid_key, grid_surface, layout)
+        _, _, grid_surface, layout = self.spritesheet_grid
+        screen.blit(grid_surface, (layout.left, layout.top))
+
+        self.render_selection_border(screen)
+        return layout
+
+    def render_selection_border(self, screen):
+        self.border_rect = None
+        layout = self.spritesheet_grid[3]
+        if 0 <= self.current_state_index < len(layout.row_lengths) and 0 <= self.current_sprite_index < layout.row_lengths[self.current_state_index]:
+            self.border_rect = layout.cell_rect(self.current_state_index, self.current_sprite_index).inflate(4, 4)
+            pygame.draw.rect(screen, (255, 0, 0), self.border_rect, 2)
+        return self.border_rect
+
+    def compose_spritesheet(self, screen, play_pause_button_rect):
         sprite_width, sprite_height = self.sprite_width, self.sprite_height
         max_sprites_per_row = max(len(state.sprites) for state in self.sprite_entity.states)
         
@@ -452,48 +1528,63 @@ class SpriteManager:
         
         total_width = scaled_sprite_width * max_sprites_per_row
         margin = max((screen.get_width() - total_width) // 2, int(screen.get_width() * 0.025))
+        top = play_pause_button_rect.bottom + 40
+
+        # The grid is drawn once onto an opaque surface matching the screen background
+        # so each frame only costs a single blit
+        grid_surface = pygame.Surface((max(total_width, 0), max(scaled_sprite_height * spritesheet_rows, 0))).convert()
+        grid_surface.fill((255, 255, 255))
         
-        sprite_rects = []
-        x = y = 0
+        layout = SpritesheetLayout(margin, top, scaled_sprite_width, scaled_sprite_height, [len(state.sprites) for state in self.sprite_entity.states])
         for state_index, state in enumerate(self.sprite_entity.states):
             for sprite_index, sprite in enumerate(state.sprites):
-                sprite_position = (
-                    x * scaled_sprite_width + margin,
-                    y * scaled_sprite_height + play_pause_button_rect.bottom + 40
-                )
-                sprite_rect = pygame.Rect(
-                    sprite_position[0],
-                    sprite_position[1],
-                    scaled_sprite_width,
-                    scaled_sprite_height
-                )
-                scaled_sprite = pygame.transform.scale(sprite.image, (scaled_sprite_width, scaled_sprite_height))
-                screen.blit(scaled_sprite, sprite_rect)
-                sprite_rects.append((sprite_rect, state_index, sprite_index))
-                
-                if state_index == self.current_state_index and sprite_index == self.current_sprite_index:
-                    border_rect = pygame.Rect(sprite_rect.left - 2, sprite_rect.top - 2, sprite_rect.width + 4, sprite_rect.height + 4)
-                    pygame.draw.rect(screen, (255, 0, 0), border_rect, 2)
-                
-                x += 1
-                if x >= len(state.sprites):
-                    x = 0
-                    y += 1
+                image_size, (image_x, image_y) = sprite.placement(self.cell_size(), (scaled_sprite_width, scaled_sprite_height))
+                if image_size[0] > 0 and image_size[1] > 0:
+                    scaled_sprite = self.scaled_surface_cache.get(sprite.get_image(), image_size)
+                    grid_surface.blit(scaled_sprite, (sprite_index * scaled_sprite_width + image_x, state_index * scaled_sprite_height + image_y))
         
-        return sprite_rects
+        return grid_surface, layout
     
+    def render_preview(self, screen):
+        target_scale = min(screen.get_width() / (self.sprite_width * 5), screen.get_height() / (self.sprite_height * 5))
+        target_size = (int(self.sprite_width * target_scale), int(self.sprite_height * target_scale))
+        current_sprite = self.sprite_entity.states[self.current_state_index].sprites[self.current_sprite_index]
+        return self.render_sprite(screen, current_sprite, (screen.get_width() // 2, screen.get_height() // 4), target_size)
+
+    def render_frame_update(self, screen):
+        # Redraws only the regions that depend on the shown frame and returns them,
+        # or None when the last full render can't be patched and a full redraw is needed
+        if self.preview_rect is None or self.spritesheet_grid is None or self.spritesheet_grid[0] is not self.sprite_entity:
+            return None
+        dirty_rects = [self.preview_rect, self.text_rect]
+        screen.fill((255, 255, 255), self.preview_rect)
+        screen.fill((255, 255, 255), self.text_rect)
+        if self.border_rect is not None:
+            _, _, grid_surface, layout = self.spritesheet_grid
+            grid_x, grid_y = layout.left, layout.top
+            dirty_rects.append(self.border_rect)
+            screen.fill((255, 255, 255), self.border_rect)
+            screen.blit(grid_surface, self.border_rect.topleft, self.border_rect.move(-grid_x, -grid_y))
+        self.preview_rect = self.render_preview(screen)
+        self.text_rect = self.render_text(screen)
+        if self.render_selection_border(screen) is not None:
+            dirty_rects.append(self.border_rect)
+        dirty_rects.extend([self.preview_rect, self.text_rect])
+        return dirty_rects
+
     def render(self, screen):
         screen.fill((255, 255, 255))
+        self.preview_rect = None
+        self.text_rect = None
+        self.border_rect = None
         if self.sprite_entity is not None:
             if self.sprite_width > 0 and self.sprite_height > 0:
                 if 0 <= self.current_state_index < len(self.sprite_entity.states) and \
                 0 <= self.current_sprite_index < len(self.sprite_entity.states[self.current_state_index].sprites):
-                    target_scale = min(screen.get_width() / (self.sprite_width * 5), screen.get_height() / (self.sprite_height * 5))
-                    target_size = (int(self.sprite_width * target_scale), int(self.sprite_height * target_scale))
-                    current_sprite = self.sprite_entity.states[self.current_state_index].sprites[self.current_sprite_index]
-                    sprite_rect = self.render_sprite(screen, current_sprite, (screen.get_width() // 2, screen.get_height() // 4), target_size)
-                    self.render_text(screen)
+                    sprite_rect = self.render_preview(screen)
+                    self.text_rect = self.render_text(screen)
                     if sprite_rect is not None:
+                        self.preview_rect = sprite_rect
                         play_pause_button_rect = self.render_play_pause_button(screen, (screen.get_width() // 2, sprite_rect.bottom + 20))
                         speed_control_rects = self.render_speed_control_buttons(screen, play_pause_button_rect)
                         prev_button_rect, next_button_rect = self.render_navigation_buttons(screen)
@@ -515,6 +1606,12 @@ class SpriteManager:
                 speed_control_rects = None
                 prev_button_rect = None
                 next_button_rect = None
+        elif self.pending_load is not None:
+            self.render_error_message(screen, f"Loading {os.path.basename(self.spritesheet_path)}...")
+            play_pause_button_rect = None
+            speed_control_rects = None
+            prev_button_rect = None
+            next_button_rect = None
         else:
             self.render_error_message(screen, "No sprite entity loaded. Press 'L' to load.")
             play_pause_button_rect = None
@@ -523,12 +1620,12 @@ class SpriteManager:
             next_button_rect = None
         return play_pause_button_rect, speed_control_rects, prev_button_rect, next_button_rect
     
-def visualize_app(spritesheet_path, sprite_width, sprite_height, scale_factor=1.0):
+def visualize_app(spritesheet_path, sprite_width, sprite_height, scale_factor=1.0, dirty_rects=False, output_folder=DEFAULT_OUTPUT_FOLDER, profile=False, trace_path=None):
     screen_width = 1920
     screen_height = 1000
     screen = pygame.display.set_mode((screen_width, screen_height))
     clock = pygame.time.Clock()
-    sprite_manager = SpriteManager(spritesheet_path, sprite_width, sprite_height, scale_factor)
+    sprite_manager = SpriteManager(spritesheet_path, sprite_width, sprite_height, scale_factor, output_folder)
     input_box_width = pygame.Rect(screen_width - 610, 10, 200, 30)
     input_box_height = pygame.Rect(screen_width - 610, 50, 200, 30)
     entity_text_box = pygame.Rect(screen_width - 400, 10, 350, 30)
@@ -544,11 +1641,46 @@ def visualize_app(spritesheet_path, sprite_width, sprite_height, scale_factor=1.
     prev_button_rect = None
     next_button_rect = None
     running = True
+    needs_full_redraw = True
+    # F3 toggles the profiling overlay; without a trace file the profiler only exists while it is shown
+    profiler = None
+    show_profiler = profile
+    if profile or trace_path:
+        profiler = FrameProfiler(trace_path=trace_path)
+        profiler.instrument(sprite_manager)
     while running:
-        dt = clock.tick(60) / 1000  # Get the time since the last frame in seconds
-        for event in pygame.event.get():
+        if profiler is not None:
+            profiler.start_frame()
+        if dirty_rects and not needs_full_redraw:
+            # Sleep until there is input or the next animation frame is due
+            timeout = sprite_manager.time_until_next_frame()
+            if timeout is None:
+                events = [pygame.event.wait()]
+            else:
+                events = [pygame.event.wait(max(1, int(timeout * 1000)))]
+            events.extend(pygame.event.get())
+            dt = clock.tick() / 1000
+        else:
+            dt = clock.tick(60) / 1000  # Get the time since the last frame in seconds
+            events = pygame.event.get()
+        if profiler is not None:
+            profiler.lap("wait")
+            # The frame's work starts after waiting, idle time is kept out of the frame time
+            profiler.frame_start = profiler.lap_start
+        for event in events:
+            if event.type in (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.WINDOWEXPOSED, pygame.WINDOWRESIZED):
+                needs_full_redraw = True
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                show_profiler = not show_profiler
+                if show_profiler and profiler is None:
+                    profiler = FrameProfiler()
+                    profiler.instrument(sprite_manager)
+                    profiler.start_frame()
+                elif not show_profiler and profiler is not None and profiler.trace_path is None:
+                    profiler.uninstrument()
+                    profiler = None
             elif event.type == pygame.KEYDOWN:
                 active_text_box = sprite_manager.handle_key_events(event, active_text_box)
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -564,31 +1696,67 @@ def visualize_app(spritesheet_path, sprite_width, sprite_height, scale_factor=1.
                         break
                 if not clicked_text_box:
                     active_text_box = None
-        sprite_manager.update(dt)
-        if sprite_manager.sprite_entity is not None:
-            play_pause_button_rect, speed_control_rects, prev_button_rect, next_button_rect = sprite_manager.render(screen)
-        else:
-            screen.fill((255, 255, 255))
-            sprite_manager.render_error_message(screen, "No sprite entity loaded. Press 'L' to load.")
+        if profiler is not None:
+            profiler.lap("events")
+        frame_changed = sprite_manager.update(dt)
+        if profiler is not None:
+            profiler.lap("update")
+        if dirty_rects and not needs_full_redraw:
+            if not frame_changed:
+                if profiler is not None:
+                    profiler.end_frame()
+                continue
+            changed_rects = sprite_manager.render_frame_update(screen)
+            if changed_rects is not None:
+                sprite_manager.render_text_boxes(screen, text_boxes, active_text_box)
+                if profiler is not None:
+                    profiler.lap("render_frame_update")
+                if profiler is not None and show_profiler:
+                    changed_rects.append(profiler.render_overlay(screen, sprite_manager.text_cache))
+                    profiler.lap("overlay")
+                pygame.display.update(changed_rects + text_boxes)
+                if profiler is not None:
+                    profiler.lap("display_update")
+                    profiler.end_frame()
+                continue
+        play_pause_button_rect, speed_control_rects, prev_button_rect, next_button_rect = sprite_manager.render(screen)
         sprite_manager.render_text_boxes(screen, text_boxes, active_text_box)
+        if profiler is not None:
+            profiler.lap("render")
+        if profiler is not None and show_profiler:
+            profiler.render_overlay(screen, sprite_manager.text_cache)
+            profiler.lap("overlay")
         pygame.display.flip()
+        if profiler is not None:
+            profiler.lap("display_flip")
+            profiler.end_frame()
+        needs_full_redraw = False
+    if profiler is not None:
+        profiler.save_trace()
+    # Let a save started with S finish writing before pygame goes away
+    sprite_manager.save_executor.shutdown(wait=True)
     pygame.quit()
 
-# Initialize Pygame
-pygame.init()
-# Set the display mode
-screen_width = 1600
-screen_height = 1000
-pygame.display.set_mode((screen_width, screen_height))
+if __name__ == "__main__":
+    # Initialize Pygame
+    pygame.init()
+    # Set the display mode
+    screen_width = 1600
+    screen_height = 1000
+    pygame.display.set_mode((screen_width, screen_height))
 
 
-#compose spritesheet_path with current_path + \raw_sprites\ + fire_FREE_SpriteSheet_288x128.png"
-current_path = os.getcwd()
-#use os to copose for safety
-folder = os.path.join(current_path,"raw_sprites")
-img_name = "fire_FREE_SpriteSheet_288x128.png"
-spritesheet_path = os.path.join(folder,img_name)
+    #compose spritesheet_path with current_path + \raw_sprites\ + fire_FREE_SpriteSheet_288x128.png"
+    current_path = os.getcwd()
+    #use os to copose for safety
+    folder = os.path.join(current_path,"raw_sprites")
+    img_name = "fire_FREE_SpriteSheet_288x128.png"
+    spritesheet_path = os.path.join(folder,img_name)
 
-sprite_width = 288
-sprite_height = 128
-visualize_app(spritesheet_path, sprite_width, sprite_height, scale_factor=0.2)
\ No newline at end of file
+    sprite_width = 288
+    sprite_height = 128
+    # SPRITESTASH_PROFILE=1 opens with the profiling overlay, SPRITESTASH_TRACE=<file> writes a trace on exit
+    visualize_app(
+        spritesheet_path, sprite_width, sprite_height, scale_factor=0.2, dirty_rects=True,
+        profile=os.environ.get("SPRITESTASH_PROFILE") == "1", trace_path=os.environ.get("SPRITESTASH_TRACE")
+    )
@@ -0,0 +1,24 @@
+import numpy as np
+import pygame
+
+def make_synthetic_sheet(sheet_width, sheet_height, cell_width, cell_height, sparsity, seed=0):
+    # Random opaque blobs inside each occupied cell, with a few repeated cells so deduplication has work to do
+    rng = np.random.default_rng(seed)
+    sheet = pygame.Surface((sheet_width, sheet_height), pygame.SRCALPHA, 32)
+    previous = None
+    for y in range(0, sheet_height - cell_height + 1, cell_height):
+        for x in range(0, sheet_width - cell_width + 1, cell_width):
+            if rng.random() < sparsity:
+                continue
+            if previous is not None and rng.random() < 0.1:
+                sheet.blit(sheet.subsurface(previous).copy(), (x, y))
+                continue
+            for _ in range(int(rng.integers(1, 4))):
+                width = int(rng.integers(max(cell_width // 4, 1), cell_width // 2 + 1))
+                height = int(rng.integers(max(cell_height // 4, 1), cell_height // 2 + 1))
+                left = x + int(rng.integers(0, cell_width - width + 1))
+                top = y + int(rng.integers(0, cell_height - height + 1))
+                color = [int(value) for value in rng.integers(0, 256, 3)] + [255]
+                pygame.draw.ellipse(sheet, color, (left, top, width, height))
+            previous = pygame.Rect(x, y, cell_width, cell_height)
+    return sheet
@@ -0,0 +1,21 @@
+import os
+import sys
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_FOLDER)
+
+import pygame
+import pytest
+
+from headless import init_headless_display
+
+@pytest.fixture(scope="session", autouse=True)
+def display():
+    init_headless_display()
+    yield
+    pygame.display.quit()
+
+@pytest.fixture(scope="session")
+def raw_sprites():
+    return os.path.join(ROOT_FOLDER, "raw_sprites")
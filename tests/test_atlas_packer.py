@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pygame
+import pytest
+
+from atlas_packer import TextureAtlas, load_atlas_index, pack_rects
+from spritesheet_visualizer import SpriteEntity
+
+@pytest.fixture
+def sprite_entities(raw_sprites):
+    # Trimmed frames have all kinds of sizes and offsets, so some of them get rotated
+    sprite_entities = []
+    for file_name, size in (("satyr-Sheet.png", 32), ("DinoSprites - doux.png", 24)):
+        sprite_entity = SpriteEntity.load_from_spritesheet(os.path.join(raw_sprites, file_name), size, size, trim=True)
+        sprite_entities.append(sprite_entity)
+    return sprite_entities
+
+def assert_no_overlaps(placements, sizes, page_width, page_height, padding):
+    # Every frame keeps padding pixels to the page edges and to every other frame on its page
+    rotated = placements[:, 3] == 1
+    sizes = np.array(sizes, dtype=np.int64).reshape(-1, 2)
+    width = np.where(rotated, sizes[:, 1], sizes[:, 0])
+    height = np.where(rotated, sizes[:, 0], sizes[:, 1])
+    x, y = placements[:, 1], placements[:, 2]
+    assert (x >= padding).all() and (y >= padding).all()
+    assert (x + width + padding <= page_width).all() and (y + height + padding <= page_height).all()
+    for page_index in np.unique(placements[:, 0]):
+        on_page = np.flatnonzero(placements[:, 0] == page_index)
+        left, top = x[on_page], y[on_page]
+        right, bottom = left + width[on_page] + padding, top + height[on_page] + padding
+        overlap = (left[:, None] < right[None]) & (left[None] < right[:, None]) & (top[:, None] < bottom[None]) & (top[None] < bottom[:, None])
+        np.fill_diagonal(overlap, False)
+        assert not overlap.any()
+
+def test_index_round_trip(sprite_entities, tmp_path):
+    atlas = TextureAtlas.pack(sprite_entities, 128, 128, padding=2, allow_rotation=True)
+    assert len(atlas.pages) > 1 and atlas.frames["rotated"].any()
+    atlas.save(str(tmp_path), binary=True)
+    json_index = load_atlas_index(str(tmp_path / "atlas.json"))
+    assert load_atlas_index(str(tmp_path / "atlas.bin")) == json_index
+    assert json_index == atlas.index()
+    assert [entity["name"] for entity in json_index["entities"]] == [sprite_entity.name for sprite_entity in sprite_entities]
+    # Every entry points at a frame whose pixels on its page are the sprite's, turned back if it was rotated
+    pages = [pygame.image.load(str(tmp_path / page)) for page in json_index["pages"]]
+    for sprite_entity, entity in zip(sprite_entities, json_index["entities"]):
+        for state, state_index in zip(sprite_entity.states, entity["states"]):
+            for sprite, (frame_index, offset_x, offset_y) in zip(state.sprites, state_index["frames"]):
+                frame = json_index["frames"][frame_index]
+                image = pages[frame["page"]].subsurface((frame["x"], frame["y"], frame["width"], frame["height"]))
+                if frame["rotated"]:
+                    image = pygame.transform.rotate(image, 90)
+                assert pygame.image.tobytes(image, "RGBA") == pygame.image.tobytes(sprite.get_image(), "RGBA")
+                assert [offset_x, offset_y] == list(sprite.trim_offset or (0, 0))
+
+def test_atlas_frames_do_not_overlap(sprite_entities):
+    atlas = TextureAtlas.pack(sprite_entities, 128, 128, padding=2, allow_rotation=True)
+    frames = atlas.frames
+    placements = np.stack([frames["page"], frames["x"], frames["y"], np.zeros(len(frames))], axis=1).astype(np.int64)
+    assert_no_overlaps(placements, np.stack([frames["width"], frames["height"]], axis=1), 128, 128, 2)
+
+@pytest.mark.parametrize("padding, allow_rotation", [(0, False), (1, True), (3, True)])
+def test_placements_do_not_overlap(padding, allow_rotation):
+    rng = np.random.default_rng(padding)
+    sizes = [tuple(size) for size in rng.integers(1, 90, (400, 2)).tolist()]
+    placements, page_count = pack_rects(sizes, 256, 192, padding, allow_rotation)
+    assert set(placements[:, 0].tolist()) == set(range(page_count))
+    assert allow_rotation or not placements[:, 3].any()
+    assert_no_overlaps(placements, sizes, 256, 192, padding)
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+
+import pygame
+import pytest
+
+from batch_ingest import MANIFEST_FILE_NAME, batch_ingest, collect_spritesheets
+from sprite_catalog import CATALOG_FILE_NAME, SpriteCatalog
+
+FRAME_SIZES = {"satyr-Sheet.png": (32, 32), "DinoSprites - doux.png": (24, 24), "spritesheet.png": (32, 32)}
+
+@pytest.fixture
+def sheet_folder(raw_sprites, tmp_path):
+    sheet_folder = tmp_path / "sheets"
+    sheet_folder.mkdir()
+    for file_name in FRAME_SIZES:
+        shutil.copy(os.path.join(raw_sprites, file_name), sheet_folder / file_name)
+    return sheet_folder
+
+def ingest(sheet_folder, output_folder, frame_sizes=FRAME_SIZES):
+    return batch_ingest(collect_spritesheets([str(sheet_folder)]), str(output_folder), frame_sizes, workers=2)
+
+def manifest(output_folder):
+    with open(output_folder / MANIFEST_FILE_NAME, 'r') as file:
+        return json.load(file)["entities"]
+
+def catalog_names(output_folder):
+    with SpriteCatalog(str(output_folder / CATALOG_FILE_NAME)) as catalog:
+        return [entity["name"] for entity in catalog.query()]
+
+def frame_files(folder_path):
+    return sorted(name for name in os.listdir(folder_path) if name != "metadata.json")
+
+def test_incremental_ingest(sheet_folder, tmp_path):
+    output_folder = tmp_path / "out"
+    names = sorted(os.path.splitext(file_name)[0] for file_name in FRAME_SIZES)
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert failures == {} and stats["skipped"] == 0 and stats["frames"] > 0
+    assert sorted(manifest(output_folder)) == names
+    assert catalog_names(output_folder) == sorted(names, key=str.encode)
+
+    # Nothing changed, nothing is sliced
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert failures == {} and stats["skipped"] == 3 and stats["frames"] == 0
+
+    # A touched sheet is hashed again but still skipped, and its new mtime is recorded
+    satyr_path = sheet_folder / "satyr-Sheet.png"
+    os.utime(satyr_path, ns=(os.stat(satyr_path).st_atime_ns, os.stat(satyr_path).st_mtime_ns + 10**9))
+    stats, _ = ingest(sheet_folder, output_folder)
+    assert stats["skipped"] == 3
+    assert manifest(output_folder)["satyr-Sheet"]["source_mtime_ns"] == os.stat(satyr_path).st_mtime_ns
+
+    # A changed sheet is sliced again
+    old_entry = manifest(output_folder)["satyr-Sheet"]
+    spritesheet = pygame.image.load(str(satyr_path))
+    spritesheet.fill((255, 0, 0, 255), (0, 0, 4, 4))
+    pygame.image.save(spritesheet, str(satyr_path))
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert failures == {} and stats["skipped"] == 2 and stats["frames"] > 0
+    new_entry = manifest(output_folder)["satyr-Sheet"]
+    assert new_entry["source_hash"] != old_entry["source_hash"] and new_entry["outputs"] != old_entry["outputs"]
+
+    # Slicing with another frame size rewrites the entity, frames of the old slicing don't linger
+    dino_folder = output_folder / "DinoSprites - doux"
+    old_frames = frame_files(dino_folder)
+    stats, failures = ingest(sheet_folder, output_folder, dict(FRAME_SIZES, **{"DinoSprites - doux.png": (48, 24)}))
+    assert failures == {} and stats["skipped"] == 2
+    new_frames = frame_files(dino_folder)
+    assert len(new_frames) < len(old_frames)
+    assert sorted(manifest(output_folder)["DinoSprites - doux"]["outputs"]) == sorted(new_frames + ["metadata.json"])
+
+    # A deleted source takes its folder, manifest entry and catalog row with it
+    os.remove(sheet_folder / "spritesheet.png")
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert failures == {} and stats["removed"] == 1
+    assert not (output_folder / "spritesheet").exists()
+    assert "spritesheet" not in manifest(output_folder)
+    assert "spritesheet" not in catalog_names(output_folder)
+
+def test_failed_sheet_is_retried(sheet_folder, tmp_path, raw_sprites):
+    output_folder = tmp_path / "out"
+    ingest(sheet_folder, output_folder)
+    # A sheet that fails loses its manifest entry, so the next run slices it again instead of trusting old outputs
+    satyr_path = sheet_folder / "satyr-Sheet.png"
+    satyr_path.write_bytes(b"not a png")
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert list(failures) == [str(satyr_path)] and stats["skipped"] == 2
+    assert "satyr-Sheet" not in manifest(output_folder)
+    shutil.copy(os.path.join(raw_sprites, "satyr-Sheet.png"), satyr_path)
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert failures == {} and stats["skipped"] == 2 and stats["frames"] > 0
+    assert "satyr-Sheet" in manifest(output_folder)
+
+def test_missing_outputs_are_rewritten(sheet_folder, tmp_path):
+    output_folder = tmp_path / "out"
+    ingest(sheet_folder, output_folder)
+    shutil.rmtree(output_folder / "satyr-Sheet")
+    stats, failures = ingest(sheet_folder, output_folder)
+    assert failures == {} and stats["skipped"] == 2
+    assert (output_folder / "satyr-Sheet" / "metadata.json").exists()
@@ -0,0 +1,100 @@
+import os
+
+import pygame
+import pytest
+
+from spritesheet_visualizer import detect_sprite_grid
+from synthetic_sheets import make_synthetic_sheet
+
+RAW_SPRITE_GRIDS = {
+    "DinoSprites - doux.png": (24, 24),
+    "DinoSprites - mort.png": (24, 24),
+    "DinoSprites - tard.png": (24, 24),
+    "DinoSprites - vita.png": (24, 24),
+    "Elementals_leaf_ranger_288x128_SpriteSheet.png": (288, 128),
+    "crystal_mauler_free_288x128_SpriteSheet.png": (288, 128),
+    "demon_slime_FREE_v1.0_288x160_spritesheet.png": (288, 160),
+    "fire_FREE_SpriteSheet_288x128.png": (288, 128),
+    "ground_monk_FREE_v1.3-SpriteSheet_288x128.png": (288, 128),
+    "satyr-Sheet.png": (32, 32),
+    "spritesheet.png": (32, 32),
+}
+
+@pytest.fixture
+def load_sheet(raw_sprites):
+    return lambda file_name: pygame.image.load(os.path.join(raw_sprites, file_name)).convert_alpha()
+
+def grid_of(spritesheet):
+    grid = detect_sprite_grid(spritesheet)
+    return grid.sprite_width, grid.sprite_height, grid.offset_x, grid.offset_y, grid.padding_x, grid.padding_y
+
+def relayout(spritesheet, cell_width, cell_height, padding, offset):
+    # Copies the cells of a tight sheet into one with padding between them and an offset before the first
+    columns = spritesheet.get_width() // cell_width
+    rows = spritesheet.get_height() // cell_height
+    size = (offset + columns * (cell_width + padding) - padding, offset + rows * (cell_height + padding) - padding)
+    padded = pygame.Surface(size, pygame.SRCALPHA, 32)
+    for row in range(rows):
+        for column in range(columns):
+            cell = spritesheet.subsurface((column * cell_width, row * cell_height, cell_width, cell_height))
+            padded.blit(cell, (offset + column * (cell_width + padding), offset + row * (cell_height + padding)))
+    return padded
+
+@pytest.mark.parametrize("file_name", sorted(RAW_SPRITE_GRIDS))
+def test_raw_sprites(load_sheet, file_name):
+    assert grid_of(load_sheet(file_name)) == (*RAW_SPRITE_GRIDS[file_name], 0, 0, 0, 0)
+
+@pytest.mark.parametrize("file_name", sorted(RAW_SPRITE_GRIDS))
+@pytest.mark.parametrize("cells", [1, 2, 3])
+def test_cropped_rows(load_sheet, file_name, cells):
+    sprite_width, sprite_height = RAW_SPRITE_GRIDS[file_name]
+    spritesheet = load_sheet(file_name)
+    if spritesheet.get_height() < cells * sprite_height:
+        pytest.skip("sheet has fewer rows")
+    cropped = spritesheet.subsurface((0, 0, spritesheet.get_width(), cells * sprite_height))
+    assert grid_of(cropped) == (sprite_width, sprite_height, 0, 0, 0, 0)
+
+@pytest.mark.parametrize("file_name", sorted(RAW_SPRITE_GRIDS))
+@pytest.mark.parametrize("cells", [1, 2, 3])
+def test_cropped_columns(load_sheet, file_name, cells):
+    sprite_width, sprite_height = RAW_SPRITE_GRIDS[file_name]
+    spritesheet = load_sheet(file_name)
+    cropped = spritesheet.subsurface((0, 0, cells * sprite_width, spritesheet.get_height()))
+    assert grid_of(cropped) == (sprite_width, sprite_height, 0, 0, 0, 0)
+
+@pytest.mark.parametrize("file_name", sorted(RAW_SPRITE_GRIDS))
+def test_single_frame(load_sheet, file_name):
+    sprite_width, sprite_height = RAW_SPRITE_GRIDS[file_name]
+    frame = load_sheet(file_name).subsurface((0, 0, sprite_width, sprite_height))
+    assert grid_of(frame) == (sprite_width, sprite_height, 0, 0, 0, 0)
+
+@pytest.mark.parametrize("size", [16, 32, 64, 100])
+def test_single_sprite(size):
+    sprite = pygame.Surface((size, size), pygame.SRCALPHA, 32)
+    pygame.draw.circle(sprite, (200, 50, 50, 255), (size // 2, size // 2), size // 3)
+    pygame.draw.rect(sprite, (50, 50, 200, 255), (size // 4, size // 2, size // 2, size // 3))
+    assert grid_of(sprite) == (size, size, 0, 0, 0, 0)
+
+@pytest.mark.parametrize("file_name", ["satyr-Sheet.png", "spritesheet.png", "fire_FREE_SpriteSheet_288x128.png", "Elementals_leaf_ranger_288x128_SpriteSheet.png"])
+def test_halved_sheet(load_sheet, file_name):
+    # Cutting through a row leaves a partial last cell, the pitch must survive it
+    sprite_width, sprite_height = RAW_SPRITE_GRIDS[file_name]
+    spritesheet = load_sheet(file_name)
+    halved = spritesheet.subsurface((0, 0, spritesheet.get_width(), spritesheet.get_height() // 2))
+    assert grid_of(halved)[:2] == (sprite_width, sprite_height)
+
+@pytest.mark.parametrize("sheet_width, sheet_height, cell_width, cell_height", [
+    (2304, 1280, 288, 128), (1024, 1024, 32, 32), (512, 256, 16, 16), (1536, 768, 48, 64)
+])
+@pytest.mark.parametrize("sparsity", [0.2, 0.3])
+@pytest.mark.parametrize("seed", range(5))
+def test_synthetic_sheets(sheet_width, sheet_height, cell_width, cell_height, sparsity, seed):
+    spritesheet = make_synthetic_sheet(sheet_width, sheet_height, cell_width, cell_height, sparsity, seed)
+    assert grid_of(spritesheet) == (cell_width, cell_height, 0, 0, 0, 0)
+
+@pytest.mark.parametrize("padding, offset", [(1, 0), (2, 0), (4, 3)])
+def test_padded_sheets(load_sheet, padding, offset):
+    spritesheet = relayout(make_synthetic_sheet(1024, 1024, 32, 32, 0.2, 0), 32, 32, padding, offset)
+    assert grid_of(spritesheet) == (32, 32, offset, offset, padding, padding)
+    spritesheet = relayout(load_sheet("spritesheet.png"), 32, 32, padding, offset)
+    assert grid_of(spritesheet) == (32, 32, offset, offset, padding, padding)
@@ -0,0 +1,89 @@
+import io
+import os
+import struct
+import zlib
+
+import numpy as np
+import pygame
+import pytest
+
+from png_encoder import PNG_SIGNATURE, encode_apng, encode_png, png_chunk
+
+def read_chunks(data):
+    assert data[:8] == PNG_SIGNATURE
+    chunks = []
+    position = 8
+    while position < len(data):
+        length, = struct.unpack(">I", data[position:position + 4])
+        chunk_type = data[position + 4:position + 8]
+        chunk_data = data[position + 8:position + 8 + length]
+        crc, = struct.unpack(">I", data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + chunk_data)
+        chunks.append((chunk_type, chunk_data))
+        position += 12 + length
+    return chunks
+
+def decode(data):
+    image = pygame.image.load(io.BytesIO(data), "image.png")
+    return image.get_size(), pygame.image.tobytes(image, "RGBA")
+
+def random_rgba(width, height, seed):
+    rng = np.random.default_rng(seed)
+    # Gradients for Up and Paeth to win on, noise and transparent runs for None and Sub
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 7, y * 5, x + y, np.full_like(x, 255)], axis=2).astype(np.uint8)
+    noisy = rng.random((height, width)) < 0.3
+    pixels[noisy] = rng.integers(0, 256, (int(noisy.sum()), 4), dtype=np.uint8)
+    pixels[rng.random((height, width)) < 0.2] = 0
+    return pixels.tobytes()
+
+@pytest.mark.parametrize("width, height", [(1, 1), (3, 5), (7, 2), (33, 17), (64, 1), (1, 64)])
+@pytest.mark.parametrize("paeth", [True, False])
+@pytest.mark.parametrize("compress_level", [0, 6])
+def test_png_round_trip(width, height, paeth, compress_level):
+    rgba = random_rgba(width, height, width * 100 + height)
+    data = encode_png(width, height, rgba, compress_level, paeth)
+    assert [chunk_type for chunk_type, _ in read_chunks(data)] == [b"IHDR", b"IDAT", b"IEND"]
+    assert decode(data) == ((width, height), rgba)
+
+@pytest.mark.parametrize("paeth", [True, False])
+def test_png_filters(paeth):
+    # A random step per column plus one per row: Sub and Up each miss by one of the steps, Paeth takes the smaller
+    # one per pixel and has to break its ties the way decoders do
+    width, height = 48, 40
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    rgba = (rng.integers(0, 8, (width, 4))[x] + rng.integers(0, 8, (height, 4))[y]).astype(np.uint8)
+    data = encode_png(width, height, rgba.tobytes(), paeth=paeth)
+    assert decode(data) == ((width, height), rgba.tobytes())
+    idat = dict(read_chunks(data))[b"IDAT"]
+    filter_types = set(zlib.decompress(idat)[::width * 4 + 1])
+    assert filter_types <= ({0, 1, 2, 4} if paeth else {0, 1, 2})
+    assert (4 in filter_types) == paeth
+
+def test_png_raw_sprite(raw_sprites):
+    image = pygame.image.load(os.path.join(raw_sprites, "satyr-Sheet.png"))
+    rgba = pygame.image.tobytes(image, "RGBA")
+    assert decode(encode_png(*image.get_size(), rgba)) == (image.get_size(), rgba)
+
+def test_apng_chunks():
+    width, height = 13, 7
+    frames = [random_rgba(width, height, seed) for seed in (1, 1, 2, 3, 3, 3)]
+    data = encode_apng(width, height, frames, [100, 50, 100, 40, 40, 40], loop_count=2)
+    chunks = read_chunks(data)
+    assert [chunk_type for chunk_type, _ in chunks] == [
+        b"IHDR", b"acTL", b"fcTL", b"IDAT", b"fcTL", b"fdAT", b"fcTL", b"fdAT", b"IEND"
+    ]
+    assert struct.unpack(">II", chunks[1][1]) == (3, 2)
+    # fcTL and fdAT share one sequence counting up from 0, IDAT takes no number
+    sequence = [struct.unpack(">I", chunk_data[:4])[0] for chunk_type, chunk_data in chunks if chunk_type in (b"fcTL", b"fdAT")]
+    assert sequence == list(range(5))
+    frame_controls = [struct.unpack(">IIIIIHHBB", chunk_data) for chunk_type, chunk_data in chunks if chunk_type == b"fcTL"]
+    assert [control[1:5] for control in frame_controls] == [(width, height, 0, 0)] * 3
+    # Runs of identical frames are merged into one frame shown for their summed delay
+    assert [control[5:] for control in frame_controls] == [(150, 1000, 1, 0), (100, 1000, 1, 0), (120, 1000, 1, 0)]
+    frame_data = [chunk_data if chunk_type == b"IDAT" else chunk_data[4:] for chunk_type, chunk_data in chunks if chunk_type in (b"IDAT", b"fdAT")]
+    for expected, compressed in zip([frames[0], frames[2], frames[3]], frame_data):
+        # Each frame's data is a complete image stream, wrapped as a plain PNG it decodes to the frame
+        png = PNG_SIGNATURE + png_chunk(b"IHDR", chunks[0][1]) + png_chunk(b"IDAT", compressed) + png_chunk(b"IEND", b"")
+        assert decode(png) == ((width, height), expected)
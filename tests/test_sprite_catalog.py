@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from sprite_catalog import CATALOG_FILE_NAME, SpriteCatalog, main
+from spritesheet_visualizer import SpriteEntity
+
+@pytest.fixture
+def catalog_folder(raw_sprites, tmp_path):
+    with SpriteCatalog(str(tmp_path / CATALOG_FILE_NAME)) as catalog:
+        for file_name, size in (("satyr-Sheet.png", 32), ("DinoSprites - doux.png", 24), ("demon_slime_FREE_v1.0_288x160_spritesheet.png", 288)):
+            sprite_entity = SpriteEntity.load_from_spritesheet(os.path.join(raw_sprites, file_name), size, 160 if size == 288 else size)
+            catalog.upsert(sprite_entity, str(tmp_path / sprite_entity.name))
+    return str(tmp_path)
+
+def names(catalog_folder, text):
+    with SpriteCatalog(os.path.join(catalog_folder, CATALOG_FILE_NAME)) as catalog:
+        return [entity["name"] for entity in catalog.query(text)]
+
+@pytest.mark.parametrize("text, expected", [
+    ("satyr-Sheet", ["satyr-Sheet"]),
+    ("demon-slime", ["demon_slime_FREE_v1.0_288x160_spritesheet"]),
+    ("DinoSprites - doux", ["DinoSprites - doux"]),
+    ("slime OR dino*", ["DinoSprites - doux", "demon_slime_FREE_v1.0_288x160_spritesheet"]),
+    ("(satyr OR doux) NOT dino*", ["satyr-Sheet"]),
+    ("name:sat*", ["satyr-Sheet"]),
+    ('"demon slime"', ["demon_slime_FREE_v1.0_288x160_spritesheet"]),
+])
+def test_search_text(catalog_folder, text, expected):
+    assert names(catalog_folder, text) == expected
+
+def test_search_command(catalog_folder, capsys):
+    assert main(["--output", catalog_folder, "search", "demon-slime"]) == 0
+    assert "1 entities" in capsys.readouterr().out
+    with pytest.raises(SystemExit) as exit_info:
+        main(["--output", catalog_folder, "search", "slime AND"])
+    assert exit_info.value.code == 2
+    assert "invalid search 'slime AND'" in capsys.readouterr().err
@@ -0,0 +1,37 @@
+import os
+
+import pygame
+import pytest
+
+from sprite_catalog import CATALOG_FILE_NAME, SpriteCatalog
+from spritesheet_visualizer import ATLAS_FORMATS, SpriteEntity
+
+@pytest.fixture
+def saved_entity(raw_sprites, tmp_path):
+    sprite_entity = SpriteEntity.load_from_spritesheet(os.path.join(raw_sprites, "satyr-Sheet.png"), 32, 32)
+    folder_path = str(tmp_path / "satyr")
+    sprite_entity.save_to_file(folder_path)
+    return sprite_entity, os.path.join(folder_path, "metadata.json")
+
+def frame_bytes(sprite_entity):
+    return [pygame.image.tobytes(sprite.get_image(), "RGBA") for state in sprite_entity.states for sprite in state.sprites]
+
+@pytest.mark.parametrize("atlas_format", ATLAS_FORMATS)
+def test_lazy_entity_saved_as_atlas(saved_entity, tmp_path, atlas_format):
+    sprite_entity, metadata_path = saved_entity
+    lazy_entity = SpriteEntity.load_from_file(metadata_path, lazy=True)
+    lazy_entity.save_to_file(str(tmp_path / "atlas"), atlas_format)
+    assert all(sprite.get_image() is not None for state in lazy_entity.states for sprite in state.sprites)
+    assert frame_bytes(lazy_entity) == frame_bytes(sprite_entity)
+    # Saving again and reloading still sees the same frames
+    lazy_entity.save_to_file(str(tmp_path / "again"))
+    assert frame_bytes(SpriteEntity.load_from_file(str(tmp_path / "again" / "metadata.json"))) == frame_bytes(sprite_entity)
+    assert lazy_entity.dedup_stats()["frames"] == len(frame_bytes(sprite_entity))
+
+def test_catalog_only_when_asked(saved_entity, tmp_path):
+    sprite_entity, _ = saved_entity
+    assert not os.path.exists(tmp_path / CATALOG_FILE_NAME)
+    catalog_path = str(tmp_path / "library" / CATALOG_FILE_NAME)
+    sprite_entity.save_to_file(str(tmp_path / "library" / "satyr"), catalog_path=catalog_path)
+    with SpriteCatalog(catalog_path) as catalog:
+        assert [row["name"] for row in catalog.query()] == [sprite_entity.name]
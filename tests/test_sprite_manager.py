@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import Future
+
+import pygame
+import pytest
+
+from spritesheet_visualizer import SpriteManager
+
+@pytest.fixture
+def sprite_manager(raw_sprites):
+    pygame.font.init()
+    sprite_manager = SpriteManager(os.path.join(raw_sprites, "satyr-Sheet.png"), 32, 32)
+    yield sprite_manager
+    sprite_manager.loader.executor.shutdown(wait=True, cancel_futures=True)
+
+def key_event(key, unicode=""):
+    return pygame.event.Event(pygame.KEYDOWN, key=key, unicode=unicode)
+
+@pytest.mark.parametrize("text_box", range(2, 8))
+def test_typing_while_loading(sprite_manager, text_box):
+    # While a sheet loads in the background there is no entity to edit
+    sprite_manager.sprite_entity = None
+    assert sprite_manager.handle_key_events(key_event(pygame.K_a, "a"), text_box) == text_box
+    assert sprite_manager.handle_key_events(key_event(pygame.K_BACKSPACE), text_box) == text_box
+
+def test_catalog_error_ends_save(sprite_manager):
+    sprite_manager.pending_save = Future()
+    sprite_manager.pending_save.set_exception(sqlite3.OperationalError("database is locked"))
+    assert sprite_manager.update_save_status()
+    assert sprite_manager.save_status == "Save failed: database is locked"
+    assert sprite_manager.pending_save is None
+
+def test_emptied_size_box(sprite_manager):
+    # Backspacing the width away reslices at 0 once the debounce runs out, which leaves no entity to show
+    sprite_manager.load_spritesheet()
+    sprite_manager.sprite_width = 3
+    assert sprite_manager.handle_key_events(key_event(pygame.K_BACKSPACE), 0) == 0
+    assert sprite_manager.sprite_width == 0
+    sprite_manager.reslice_deadline = time.monotonic()
+    assert sprite_manager.update_frame(0.0)
+    assert sprite_manager.sprite_entity is None
+    screen = pygame.Surface((1200, 800))
+    text_boxes = [pygame.Rect(10, 10 + 40 * i, 200, 32) for i in range(8)]
+    sprite_manager.render(screen)
+    sprite_manager.render_text_boxes(screen, text_boxes, 0)
+    for key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN):
+        assert sprite_manager.handle_key_events(key_event(key), None) is None
+    sprite_manager.is_playing = True
+    sprite_manager.update_frame(1.0)